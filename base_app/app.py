@@ -4,13 +4,18 @@ import chainlit as cl
 import openai
 from langsmith.wrappers import wrap_openai
 from langsmith import traceable
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, load_index_from_storage
 
+from embedding_cache import use_embedding_cache
+from history import build_prompt
+from index_manager import IndexManager
 from prompts import SYSTEM_PROMPT
 
 # Load environment variables
 load_dotenv()
 
+# Serve query and chunk embeddings from the local cache when they've been seen before
+use_embedding_cache()
+
 configurations = {
     "openai_gpt-4": {
         "endpoint_url": os.getenv("OPENAI_ENDPOINT"),
@@ -37,24 +42,17 @@ gen_kwargs = {
 # Configuration setting to enable or disable the system prompt
 ENABLE_SYSTEM_PROMPT = True
 
-retriever = None
-index_location = './data_index/'
+# Maximum number of prompt tokens sent per request; older turns beyond it are dropped
+HISTORY_TOKEN_BUDGET = 6000
+
+# The index is shared by every session, and starts loading as soon as the server boots
+index_manager = IndexManager()
+index_manager.warm_up()
 
 @cl.on_chat_start
 async def start_main():
-    if os.path.exists(index_location):
-        # Load dataset from local file if it exists
-        storage_context = StorageContext.from_defaults(persist_dir=index_location)
-        # load index
-        index = load_index_from_storage(storage_context)
-    else:
-        # Generate dataset if local file doesn't exist
-        # Load documents from a directory (you can change this path as needed)
-        documents = SimpleDirectoryReader("data").load_data()
-        index = VectorStoreIndex.from_documents(documents)
-        index.storage_context.persist(persist_dir=index_location)
-    global retriever
-    retriever = index.as_retriever(retrieval_mode='similarity', k=3)
+    # Pick up an index rebuilt by `python ingest.py` without restarting the server
+    index_manager.reload_if_changed()
 
 @traceable
 @cl.on_message
@@ -67,6 +65,7 @@ async def on_message(message: cl.Message):
         message_history.insert(0, {"role": "system", "content": system_prompt_content})
 
     # get relevant docs from rag/index
+    retriever = await index_manager.aget_retriever()
     relevant_docs = retriever.retrieve(message.content)
     doc_content = ""
     for i, doc in enumerate(relevant_docs):
@@ -82,8 +81,11 @@ async def on_message(message: cl.Message):
     response_message = cl.Message(content="")
     await response_message.send()
 
-    # Pass in the full message history for each request
-    stream = await client.chat.completions.create(messages=message_history,
+    # Pass in the system prompts and as many recent turns as fit in the token budget
+    messages, prompt_metrics = build_prompt(message_history, HISTORY_TOKEN_BUDGET)
+    print("Prompt metrics:", prompt_metrics)
+    cl.user_session.set("prompt_metrics", prompt_metrics)
+    stream = await client.chat.completions.create(messages=messages,
                                                   stream=True, **gen_kwargs)
     async for part in stream:
         if token := part.choices[0].delta.content or "":
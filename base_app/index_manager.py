@@ -0,0 +1,89 @@
+"""
+Process-wide holder for the RAG index and its retriever.
+
+The index is loaded once per process, on first use or by warm_up() at server boot,
+instead of on every chat start. A lock makes sure concurrent sessions only trigger
+a single load, and reload() builds a fresh index off to the side before swapping it
+in, so live sessions keep answering from the old index until the new one is ready.
+"""
+
+import asyncio
+import os
+import threading
+
+from ingest import ingest, load_index, DATA_DIR, INDEX_LOCATION, MANIFEST_FILENAME
+from numpy_vector_store import NumpyVectorStore
+
+
+class IndexManager:
+    def __init__(self, persist_dir=INDEX_LOCATION, data_dir=DATA_DIR, retriever_kwargs=None):
+        self.persist_dir = persist_dir
+        self.data_dir = data_dir
+        self.retriever_kwargs = retriever_kwargs or {"retrieval_mode": "similarity", "k": 3}
+
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._index = None
+        self._retriever = None
+        self._loaded_version = None
+
+    def _index_version(self):
+        """The manifest is written last by ingest, so its mtime marks a finished update."""
+        try:
+            return os.stat(os.path.join(self.persist_dir, MANIFEST_FILENAME)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _build(self):
+        version = self._index_version()
+        if NumpyVectorStore.exists(self.persist_dir):
+            index = load_index(self.persist_dir)
+        else:
+            index, _ = ingest(self.data_dir, self.persist_dir)
+            version = self._index_version()
+        return index, index.as_retriever(**self.retriever_kwargs), version
+
+    def get_retriever(self):
+        retriever = self._retriever
+        if retriever is not None:
+            return retriever
+
+        with self._lock:
+            # Another thread may have finished loading while we waited on the lock
+            if self._retriever is None:
+                self._index, self._retriever, self._loaded_version = self._build()
+            return self._retriever
+
+    async def aget_retriever(self):
+        retriever = self._retriever
+        if retriever is not None:
+            return retriever
+        return await asyncio.to_thread(self.get_retriever)
+
+    def warm_up(self):
+        """Loads the index in a background thread so the first chat doesn't wait on it."""
+        thread = threading.Thread(target=self.get_retriever, name="index-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def reload(self):
+        """
+        Loads the index from disk again and swaps it in atomically.
+
+        Sessions that already fetched the old retriever finish their current query
+        with it; the next call to get_retriever() returns the new one.
+        """
+        with self._reload_lock:
+            index, retriever, version = self._build()
+            with self._lock:
+                self._index, self._retriever, self._loaded_version = index, retriever, version
+
+    def reload_if_changed(self):
+        """Reloads in the background if ingest has updated the index since it was loaded."""
+        if self._retriever is None or self._reload_lock.locked():
+            return False
+        version = self._index_version()
+        if version is None or version == self._loaded_version:
+            return False
+        threading.Thread(target=self.reload, name="index-reload", daemon=True).start()
+        return True
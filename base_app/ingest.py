@@ -0,0 +1,190 @@
+"""
+Incremental ingestion for the base app RAG index.
+
+Each file under the data directory is fingerprinted (size, mtime and a sha256 of its
+contents) and the fingerprints are stored next to the persisted index. On each run only
+new or changed files are read and embedded, and the nodes of removed files are deleted,
+so a daily corpus update doesn't require re-embedding everything.
+
+Run it offline, before starting the chat server:
+
+    python ingest.py                 # incremental update of ./data_index/ from ./data/
+    python ingest.py --rebuild       # throw away the index and embed everything again
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+from dotenv import load_dotenv
+from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, load_index_from_storage
+
+from embedding_cache import use_embedding_cache
+from numpy_vector_store import NumpyVectorStore
+
+DATA_DIR = "data"
+INDEX_LOCATION = "./data_index/"
+MANIFEST_FILENAME = "ingest_manifest.json"
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_data_dir(data_dir):
+    """Returns {relative path: (size, mtime)} for every file under data_dir."""
+    files = {}
+    for root, _, filenames in os.walk(data_dir):
+        for filename in filenames:
+            if filename.startswith("."):
+                continue
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            files[os.path.relpath(path, data_dir)] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def load_manifest(persist_dir):
+    """Returns the stored fingerprints, or None if the index was built without a manifest."""
+    manifest_path = os.path.join(persist_dir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        return json.load(f).get("files", {})
+
+
+def save_manifest(persist_dir, manifest):
+    manifest_path = os.path.join(persist_dir, MANIFEST_FILENAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"files": manifest}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def diff_files(data_dir, manifest):
+    """
+    Compares the data directory against the manifest.
+
+    Size and mtime are checked first; the content hash is only computed when they
+    differ, so unchanged files are never read. Files that were touched but whose
+    content is identical are reported as unchanged, with refreshed fingerprints.
+
+    Returns (added, changed, removed, fingerprints) where fingerprints maps every
+    current relative path to its {"size", "mtime", "sha256"} entry.
+    """
+    added, changed = [], []
+    fingerprints = {}
+
+    for rel_path, (size, mtime) in scan_data_dir(data_dir).items():
+        previous = manifest.get(rel_path)
+        if previous and previous["size"] == size and previous["mtime"] == mtime:
+            fingerprints[rel_path] = {"size": size, "mtime": mtime, "sha256": previous["sha256"]}
+            continue
+
+        sha256 = file_sha256(os.path.join(data_dir, rel_path))
+        fingerprints[rel_path] = {"size": size, "mtime": mtime, "sha256": sha256}
+        if previous is None:
+            added.append(rel_path)
+        elif previous["sha256"] != sha256:
+            changed.append(rel_path)
+
+    removed = [rel_path for rel_path in manifest if rel_path not in fingerprints]
+    return added, changed, removed, fingerprints
+
+
+def load_index(persist_dir=INDEX_LOCATION):
+    vector_store = NumpyVectorStore.from_persist_dir(persist_dir)
+    storage_context = StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store)
+    return load_index_from_storage(storage_context)
+
+
+def read_documents(data_dir, rel_paths):
+    """Reads the given files, returning {relative path: [documents]}."""
+    if not rel_paths:
+        return {}
+    input_files = [os.path.join(data_dir, rel_path) for rel_path in rel_paths]
+    documents = SimpleDirectoryReader(input_files=input_files, filename_as_id=True).load_data()
+
+    by_file = {rel_path: [] for rel_path in rel_paths}
+    for document in documents:
+        rel_path = os.path.relpath(document.metadata["file_path"], data_dir)
+        by_file.setdefault(rel_path, []).append(document)
+    return by_file
+
+
+def ingest(data_dir=DATA_DIR, persist_dir=INDEX_LOCATION, rebuild=False, ivf_lists=None):
+    """
+    Brings the persisted index in persist_dir up to date with data_dir.
+
+    ivf_lists switches the vector store to approximate search with that many clusters
+    (0 for exact search); None keeps the current setting.
+
+    Returns the index and a summary dict with the added/changed/removed file lists.
+    """
+    manifest = None
+    if not rebuild and NumpyVectorStore.exists(persist_dir):
+        manifest = load_manifest(persist_dir)
+    # An index without a manifest can't be diffed, so it is rebuilt once
+    incremental = manifest is not None
+    manifest = manifest or {}
+
+    added, changed, removed, fingerprints = diff_files(data_dir, manifest)
+    summary = {"added": added, "changed": changed, "removed": removed}
+
+    if incremental:
+        index = load_index(persist_dir)
+    else:
+        storage_context = StorageContext.from_defaults(vector_store=NumpyVectorStore())
+        index = VectorStoreIndex([], storage_context=storage_context)
+    if ivf_lists is not None:
+        index.vector_store.ivf_lists = ivf_lists
+
+    # Changed files are deleted and re-inserted, since their chunking may differ
+    for rel_path in removed + changed:
+        for doc_id in manifest[rel_path].get("doc_ids", []):
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+
+    documents_by_file = read_documents(data_dir, added + changed)
+    for rel_path, documents in documents_by_file.items():
+        for document in documents:
+            index.insert(document)
+        fingerprints[rel_path]["doc_ids"] = [document.doc_id for document in documents]
+
+    # Carry over doc ids for files that didn't need re-embedding
+    for rel_path, fingerprint in fingerprints.items():
+        if "doc_ids" not in fingerprint:
+            fingerprint["doc_ids"] = manifest[rel_path].get("doc_ids", [])
+
+    index.storage_context.persist(persist_dir=persist_dir)
+    save_manifest(persist_dir, fingerprints)
+
+    return index, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally index the documents in the data directory.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory containing the source documents.")
+    parser.add_argument("--persist-dir", default=INDEX_LOCATION, help="Directory where the index is stored.")
+    parser.add_argument("--rebuild", action="store_true", help="Re-embed every document from scratch.")
+    parser.add_argument("--ivf-lists", type=int, default=None,
+                        help="Use approximate search with this many clusters (0 for exact search).")
+    args = parser.parse_args()
+
+    load_dotenv()
+    embed_model = use_embedding_cache()
+    _, summary = ingest(args.data_dir, args.persist_dir, rebuild=args.rebuild, ivf_lists=args.ivf_lists)
+
+    for key in ("added", "changed", "removed"):
+        print(f"{key}: {len(summary[key])}")
+        for rel_path in summary[key]:
+            print(f"  - {rel_path}")
+    print(f"embedding cache: {embed_model.stats}")
+
+
+if __name__ == "__main__":
+    main()
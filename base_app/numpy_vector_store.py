@@ -0,0 +1,273 @@
+"""
+A LlamaIndex vector store that keeps every embedding in one contiguous float32 matrix.
+
+Embeddings are normalized on insert, so a query is a single matrix-vector product
+followed by a partial sort, instead of a Python loop over lists of floats. The matrix
+is saved with np.save and memory-mapped on load, so opening a large index is cheap and
+the OS pages rows in as they are scanned.
+
+For very large corpora an optional IVF (inverted file) mode clusters the rows with
+k-means and only scores the rows in the `nprobe` clusters closest to the query.
+
+Node text is kept in the index's docstore (stores_text is False), so the
+`retriever.retrieve()` call path is unchanged.
+"""
+
+import json
+import os
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+MATRIX_FILENAME = "numpy_vector_store.npy"
+METADATA_FILENAME = "numpy_vector_store.json"
+IVF_FILENAME = "numpy_vector_store_ivf.npz"
+
+# Rows scored per block, which bounds the temporary memory used by a query
+QUERY_BLOCK_SIZE = 65536
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores, k):
+    """Returns the positions of the k highest scores, best first."""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def _kmeans(vectors, n_clusters, n_iter=10, seed=0):
+    """Spherical k-means on normalized vectors; returns normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            members = vectors[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+        centroids = _normalize(centroids).astype(np.float32)
+    return centroids
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    Vector store backed by a float32 NumPy matrix.
+
+    Args:
+        ivf_lists (int): Number of IVF clusters. 0 means exact search over every row.
+        nprobe (int): Number of clusters scanned per query in IVF mode.
+        ivf_min_rows (int): IVF is only used once the store has at least this many rows.
+    """
+
+    stores_text: bool = False
+    ivf_lists: int = 0
+    nprobe: int = 8
+    ivf_min_rows: int = 10000
+
+    _matrix: Any = PrivateAttr(default=None)
+    _node_ids: List[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[str] = PrivateAttr(default_factory=list)
+    _alive: Any = PrivateAttr(default=None)
+    _pending: List[Any] = PrivateAttr(default_factory=list)
+    _centroids: Any = PrivateAttr(default=None)
+    _assignments: Any = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, METADATA_FILENAME))
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, mmap: bool = True, **kwargs: Any) -> "NumpyVectorStore":
+        with open(os.path.join(persist_dir, METADATA_FILENAME), "r") as f:
+            metadata = json.load(f)
+        settings = {key: metadata[key] for key in ("ivf_lists", "nprobe", "ivf_min_rows") if key in metadata}
+        settings.update(kwargs)
+        store = cls(**settings)
+
+        store._node_ids = metadata["node_ids"]
+        store._ref_doc_ids = metadata["ref_doc_ids"]
+        if store._node_ids:
+            store._matrix = np.load(os.path.join(persist_dir, MATRIX_FILENAME), mmap_mode="r" if mmap else None)
+        store._alive = np.ones(len(store._node_ids), dtype=bool)
+
+        ivf_path = os.path.join(persist_dir, IVF_FILENAME)
+        if os.path.exists(ivf_path):
+            with np.load(ivf_path) as ivf:
+                store._centroids = ivf["centroids"]
+                store._assignments = ivf["assignments"]
+        return store
+
+    def _flush_pending(self) -> None:
+        """Appends rows added since the last query in one copy instead of one per add()."""
+        if not self._pending:
+            return
+        new_rows = np.vstack(self._pending)
+        self._pending = []
+        if self._matrix is None or len(self._matrix) == 0:
+            self._matrix = new_rows
+        else:
+            self._matrix = np.vstack([self._matrix, new_rows])
+
+        new_alive = np.ones(len(new_rows), dtype=bool)
+        self._alive = new_alive if self._alive is None else np.concatenate([self._alive, new_alive])
+
+        if self._centroids is not None:
+            new_assignments = np.argmax(new_rows @ self._centroids.T, axis=1)
+            self._assignments = np.concatenate([self._assignments, new_assignments])
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        embeddings = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        self._pending.append(_normalize(embeddings).astype(np.float32))
+        for node in nodes:
+            self._node_ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id or "")
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """Tombstones the rows of ref_doc_id; they are dropped for good on persist()."""
+        self._flush_pending()
+        if self._alive is None:
+            return
+        for row, row_ref_doc_id in enumerate(self._ref_doc_ids):
+            if row_ref_doc_id == ref_doc_id:
+                self._alive[row] = False
+
+    def build_ivf(self, n_lists: Optional[int] = None, n_iter: int = 10, sample_size: int = 50000) -> None:
+        """Clusters the rows for approximate search; k-means runs on a sample of rows."""
+        self._flush_pending()
+        n_lists = n_lists or self.ivf_lists
+        if self._matrix is None or n_lists <= 0 or len(self._matrix) < n_lists:
+            self._centroids = self._assignments = None
+            return
+
+        rng = np.random.default_rng(0)
+        sample_rows = rng.choice(len(self._matrix), size=min(sample_size, len(self._matrix)), replace=False)
+        self._centroids = _kmeans(np.asarray(self._matrix[np.sort(sample_rows)]), n_lists, n_iter=n_iter)
+
+        assignments = np.empty(len(self._matrix), dtype=np.int32)
+        for start in range(0, len(self._matrix), QUERY_BLOCK_SIZE):
+            block = np.asarray(self._matrix[start:start + QUERY_BLOCK_SIZE])
+            assignments[start:start + QUERY_BLOCK_SIZE] = np.argmax(block @ self._centroids.T, axis=1)
+        self._assignments = assignments
+
+    def _candidate_rows(self, query_vector: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        """Rows to score in IVF mode, or None to score every row."""
+        if self._centroids is None or len(self._matrix) < self.ivf_min_rows:
+            return None
+        probes = _top_k(self._centroids @ query_vector, nprobe)
+        return np.flatnonzero(np.isin(self._assignments, probes) & self._alive)
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise ValueError("Metadata filters are not supported by NumpyVectorStore.")
+
+        self._flush_pending()
+        if self._matrix is None or len(self._matrix) == 0 or query.query_embedding is None:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        query_vector = _normalize(np.asarray(query.query_embedding, dtype=np.float32))
+        k = query.similarity_top_k
+
+        allowed = self._alive
+        if query.node_ids is not None:
+            wanted = set(query.node_ids)
+            allowed = allowed & np.fromiter((node_id in wanted for node_id in self._node_ids), dtype=bool)
+
+        rows = self._candidate_rows(query_vector, kwargs.get("nprobe", self.nprobe))
+        if rows is not None:
+            rows = rows[allowed[rows]]
+            scores = np.asarray(self._matrix[rows]) @ query_vector
+            best = _top_k(scores, k)
+            best_rows, best_scores = rows[best], scores[best]
+        else:
+            # Exact search, scanning the (possibly memory-mapped) matrix block by block
+            best_rows = np.empty(0, dtype=np.int64)
+            best_scores = np.empty(0, dtype=np.float32)
+            for start in range(0, len(self._matrix), QUERY_BLOCK_SIZE):
+                block_scores = np.asarray(self._matrix[start:start + QUERY_BLOCK_SIZE]) @ query_vector
+                block_scores[~allowed[start:start + QUERY_BLOCK_SIZE]] = -np.inf
+                block_best = _top_k(block_scores, k)
+                best_rows = np.concatenate([best_rows, block_best + start])
+                best_scores = np.concatenate([best_scores, block_scores[block_best]])
+            best = _top_k(best_scores, k)
+            best_rows, best_scores = best_rows[best], best_scores[best]
+
+        keep = np.isfinite(best_scores)
+        return VectorStoreQueryResult(
+            similarities=best_scores[keep].tolist(),
+            ids=[self._node_ids[row] for row in best_rows[keep]],
+        )
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        """
+        Writes the store next to persist_path, compacting away deleted rows.
+
+        StorageContext passes the path of its default vector store file; only its
+        directory is used.
+        """
+        self._flush_pending()
+        persist_dir = os.path.dirname(persist_path) or "."
+        os.makedirs(persist_dir, exist_ok=True)
+
+        if self._alive is not None and not self._alive.all():
+            keep = np.flatnonzero(self._alive)
+            self._matrix = np.asarray(self._matrix[keep])
+            self._node_ids = [self._node_ids[row] for row in keep]
+            self._ref_doc_ids = [self._ref_doc_ids[row] for row in keep]
+            self._alive = np.ones(len(keep), dtype=bool)
+            if self._assignments is not None:
+                self._assignments = self._assignments[keep]
+
+        if self.ivf_lists and self._matrix is not None and len(self._matrix) >= self.ivf_min_rows:
+            self.build_ivf()
+        elif not self.ivf_lists:
+            self._centroids = self._assignments = None
+
+        # Write to temporary files first, so a reader never sees a half-written index
+        if self._matrix is not None and len(self._matrix):
+            matrix_path = os.path.join(persist_dir, MATRIX_FILENAME)
+            with open(matrix_path + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(self._matrix, dtype=np.float32))
+            os.replace(matrix_path + ".tmp", matrix_path)
+
+        ivf_path = os.path.join(persist_dir, IVF_FILENAME)
+        if self._centroids is not None:
+            with open(ivf_path + ".tmp", "wb") as f:
+                np.savez(f, centroids=self._centroids, assignments=self._assignments)
+            os.replace(ivf_path + ".tmp", ivf_path)
+        elif os.path.exists(ivf_path):
+            os.remove(ivf_path)
+
+        metadata_path = os.path.join(persist_dir, METADATA_FILENAME)
+        with open(metadata_path + ".tmp", "w") as f:
+            json.dump({
+                "node_ids": self._node_ids,
+                "ref_doc_ids": self._ref_doc_ids,
+                "ivf_lists": self.ivf_lists,
+                "nprobe": self.nprobe,
+                "ivf_min_rows": self.ivf_min_rows,
+            }, f)
+        os.replace(metadata_path + ".tmp", metadata_path)
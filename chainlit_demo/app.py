@@ -1,7 +1,9 @@
 import chainlit as cl
 import openai
 import os
-import base64
+import asyncio
+from history import build_prompt
+from images import forget_old_images, image_content_part
 
 api_key = os.getenv("OPENAI_API_KEY")
 
@@ -20,6 +22,9 @@ model_kwargs = {
     "max_tokens": 500
 }
 
+# Maximum number of prompt tokens sent per request; older turns beyond it are dropped
+HISTORY_TOKEN_BUDGET = 16000
+
 # model_kwargs = {
 #     "model": "mistralai/Mistral-7B-Instruct-v0.3",
 #     "temperature": 0.3,
@@ -35,9 +40,8 @@ async def on_message(message: cl.Message):
     images = [file for file in message.elements if "image" in file.mime] if message.elements else []
 
     if images:
-        # Read the first image and encode it to base64
-        with open(images[0].path, "rb") as f:
-            base64_image = base64.b64encode(f.read()).decode('utf-8')
+        # Downscale and encode the first image off the event loop
+        image_part = await asyncio.to_thread(image_content_part, images[0].path, images[0].mime)
         message_history.append({
             "role": "user",
             "content": [
@@ -45,22 +49,22 @@ async def on_message(message: cl.Message):
                     "type": "text",
                     "text": message.content if message.content else "What’s in this image?"
                 },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}"
-                    }
-                }
+                image_part
             ]
         })
+        # Only the newest image is re-sent on later turns
+        forget_old_images(message_history)
     else:
         message_history.append({"role": "user", "content": message.content})
 
     response_message = cl.Message(content="")
     await response_message.send()
 
-    # Pass in the full message history for each request
-    stream = await client.chat.completions.create(messages=message_history,
+    # Pass in as many recent turns as fit in the token budget
+    messages, prompt_metrics = build_prompt(message_history, HISTORY_TOKEN_BUDGET)
+    print("Prompt metrics:", prompt_metrics)
+    cl.user_session.set("prompt_metrics", prompt_metrics)
+    stream = await client.chat.completions.create(messages=messages,
                                                   stream=True, **model_kwargs)
     async for part in stream:
         if token := part.choices[0].delta.content or "":
@@ -0,0 +1,118 @@
+"""
+Preparing uploaded images for vision requests.
+
+Uploads are downscaled to the largest size the model actually looks at (it fits images
+within 2048x2048 and then scales the short side to 768px), re-encoded, and labelled with
+their real MIME type. Encodings are cached by a hash of the file contents, so the same
+upload is only processed once.
+
+Once a newer image has been sent, older ones are replaced in the history by a short text
+reference, so each turn doesn't re-send every image of the conversation.
+"""
+
+import base64
+import hashlib
+import io
+import mimetypes
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MAX_LONG_SIDE = 2048
+MAX_SHORT_SIDE = 768
+JPEG_QUALITY = 85
+
+# The formats the API accepts as-is
+SUPPORTED_MIME_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp"}
+
+MAX_CACHED_IMAGES = 32
+_encoded_images = OrderedDict()
+# Images are encoded on worker threads, so the cache is only touched under this lock
+_encoded_images_lock = threading.Lock()
+
+
+def image_id(url):
+    return hashlib.sha256(url.encode()).hexdigest()[:12]
+
+
+def _has_transparency(image):
+    if image.mode == "P":
+        return "transparency" in image.info
+    if image.mode not in ("RGBA", "LA"):
+        return False
+    # Screenshots often have an alpha channel that is fully opaque
+    return image.getchannel("A").getextrema()[0] < 255
+
+
+def _resize(data):
+    """Returns (bytes, mime type) of the image scaled to the model's resolution, or None if it can't be read."""
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception:
+        return None
+
+    width, height = image.size
+    scale = min(1.0, MAX_LONG_SIDE / max(width, height), MAX_SHORT_SIDE / min(width, height))
+    if scale < 1.0:
+        image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+    output = io.BytesIO()
+    # PNG keeps transparency; everything else is smaller as JPEG
+    if _has_transparency(image):
+        image.save(output, format="PNG", optimize=True)
+        return output.getvalue(), "image/png"
+    image.convert("RGB").save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue(), "image/jpeg"
+
+
+def encode_image(data, mime=None):
+    """Returns a data URL for the image bytes, downscaled and re-encoded when Pillow is available."""
+    key = hashlib.sha256(data).hexdigest()
+    with _encoded_images_lock:
+        if key in _encoded_images:
+            _encoded_images.move_to_end(key)
+            return _encoded_images[key]
+
+    encoded = _resize(data) if Image is not None else None
+    if encoded is None or (len(encoded[0]) >= len(data) and mime in SUPPORTED_MIME_TYPES):
+        # Nothing to gain from re-encoding, so the upload is sent as it is
+        encoded = data, mime or "image/jpeg"
+    image_bytes, image_mime = encoded
+
+    url = f"data:{image_mime};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+    with _encoded_images_lock:
+        _encoded_images[key] = url
+        _encoded_images.move_to_end(key)
+        if len(_encoded_images) > MAX_CACHED_IMAGES:
+            _encoded_images.popitem(last=False)
+    return url
+
+
+def image_content_part(path, mime=None):
+    """Reads an uploaded image and returns it as an image_url content part."""
+    with open(path, "rb") as f:
+        data = f.read()
+    mime = mime or mimetypes.guess_type(path)[0]
+    return {"type": "image_url", "image_url": {"url": encode_image(data, mime)}}
+
+
+def forget_old_images(message_history, keep_last=1):
+    """Replaces the images of all but the last `keep_last` image messages with a text reference, in place."""
+    seen = 0
+    for message in reversed(message_history):
+        content = message.get("content")
+        if not isinstance(content, list) or not any(part.get("type") == "image_url" for part in content):
+            continue
+        seen += 1
+        if seen <= keep_last:
+            continue
+        message["content"] = [
+            {"type": "text", "text": f"[Image {image_id(part['image_url']['url'])} was shown earlier and is no longer attached.]"}
+            if part.get("type") == "image_url" else part
+            for part in content
+        ]
@@ -8,14 +8,53 @@ Modifications made to create a cleaner document, and add metadata for filtering
 
 import base64
 import email
-from typing import Any, List, Optional
+import html
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional
 
 from llama_index.core.readers.base import BaseReader
 from llama_index.core.schema import Document
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 
+# How many characters of HTML are decoded per character of body text kept
+HTML_DECODE_FACTOR = 4
+
+_INVISIBLE_HTML = re.compile(r"<(script|style|head|title)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_HTML_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+# Block elements start and end a line, and table cells are kept apart by a space
+_HTML_LINE_BREAK = re.compile(
+    r"<br\s*/?>|<hr\b[^>]*>|</?(p|div|tr|li|ul|ol|h[1-6]|table|blockquote|pre|section|article|header|footer)\b[^>]*>",
+    re.IGNORECASE,
+)
+_HTML_CELL = re.compile(r"</?(td|th)\b[^>]*>", re.IGNORECASE)
+_HTML_TAG = re.compile(r"<[^>]+>")
+_PARTIAL_HTML_TAG = re.compile(r"<[^>]*$")
+_HORIZONTAL_SPACE = re.compile(r"[ \t\r\f\v\xa0]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+def html_to_text(html_content):
+    """Converts an HTML email body to plain text with a handful of regexes."""
+    text = _INVISIBLE_HTML.sub("", html_content)
+    text = _HTML_COMMENT.sub("", text)
+    text = _HTML_LINE_BREAK.sub("\n", text)
+    text = _HTML_CELL.sub(" ", text)
+    text = _HTML_TAG.sub("", text)
+    # A body cut off mid-tag leaves an unterminated tag at the end
+    text = _PARTIAL_HTML_TAG.sub("", text)
+    text = html.unescape(text)
+    text = _HORIZONTAL_SPACE.sub(" ", text)
+    text = _BLANK_LINES.sub("\n\n", text)
+    return "\n".join(line.strip() for line in text.split("\n")).strip()
+
 
 class CustomGmailReader(BaseReader, BaseModel):
     """Gmail reader.
@@ -28,6 +67,18 @@ class CustomGmailReader(BaseReader, BaseModel):
         service (Any): Gmail service. Defaults to None.
         results_per_page (Optional[int]): Max number of results per page. Defaults to 10.
         use_iterative_parser (bool): Use iterative parser. Defaults to False.
+        max_workers (int): Number of messages fetched concurrently. Defaults to 8.
+        service_factory (Optional[Callable[[], Any]]): Creates a Gmail service for each
+            fetch thread. The Google API client isn't thread-safe, so when the service
+            is built from credentials each thread gets its own. A `service` passed in
+            without a factory can't be copied per thread, so messages are then fetched
+            one at a time; pass `lambda: service` to share a thread-safe service.
+        checkpoint_path (Optional[str]): File where sync_data() keeps its checkpoint
+            (last historyId and the ids of messages already emitted). Defaults to None.
+        max_body_chars (int): Message bodies are truncated to this many characters.
+            Defaults to 100000.
+        max_part_size (int): MIME parts larger than this many bytes are skipped.
+            Defaults to 5000000.
     """
 
     query: str = None
@@ -35,25 +86,158 @@ class CustomGmailReader(BaseReader, BaseModel):
     max_results: int = 10
     service: Any
     results_per_page: Optional[int]
+    max_workers: int = 8
+    service_factory: Optional[Callable[[], Any]] = None
+    checkpoint_path: Optional[str] = None
+    max_body_chars: int = 100000
+    max_part_size: int = 5000000
+
+    _local: Any = PrivateAttr(default_factory=threading.local)
 
     def load_data(self) -> List[Document]:
         """Load emails from the user's account."""
-        from googleapiclient.discovery import build
+        return list(self.lazy_load_data())
 
-        credentials = self._get_credentials()
-        if not self.service:
-            self.service = build("gmail", "v1", credentials=credentials)
+    def lazy_load_data(self) -> Iterator[Document]:
+        """
+        Load emails from the user's account one at a time.
+
+        Listing, fetching and parsing are interleaved, so only a bounded window of
+        messages is held in memory and documents can be embedded as they arrive.
+        """
+        self._ensure_service()
 
-        messages = self.search_messages()
+        for message in self.iter_messages():
+            yield self._to_document(message)
 
-        results = []
+    def sync_data(self) -> List[Document]:
+        """
+        Load only the emails added since the last sync.
+
+        The first call does a full load_data() and saves a checkpoint to
+        checkpoint_path. Later calls read the mailbox history since the checkpoint's
+        historyId, so their cost scales with the amount of new mail rather than the
+        size of the mailbox. Documents use the Gmail message id as their id, so they
+        can be inserted into an existing index in place.
+        """
+        if not self.checkpoint_path:
+            raise ValueError("checkpoint_path is required for sync_data()")
+        self._ensure_service()
+
+        # Read the current historyId before listing, so mail arriving mid-sync is picked up next time
+        profile = self.service.users().getProfile(userId="me").execute()
+        sync_started_at = int(time.time())
+
+        checkpoint = self.load_checkpoint()
+        if checkpoint is None:
+            messages = self.search_messages()
+            seen_ids = set()
+        else:
+            seen_ids = set(checkpoint["seen_ids"])
+            new_ids = self._added_message_ids(checkpoint["history_id"])
+            if new_ids is None:
+                # The checkpoint is older than the history Gmail keeps, so fall back to a full listing
+                messages = self.search_messages()
+            else:
+                new_ids = [message_id for message_id in new_ids if message_id not in seen_ids]
+                if self.query and new_ids:
+                    new_ids = self._filter_by_query(new_ids, checkpoint["synced_at"])
+                # Messages deleted since they were added are skipped
+                new_messages = self.fetch_messages(({"id": message_id} for message_id in new_ids), skip_missing=True)
+                messages = [message for message in new_messages if message]
+
+        documents = []
         for message in messages:
-            text = message.pop("body")
-            metadata = message
+            if message["id"] in seen_ids:
+                continue
+            seen_ids.add(message["id"])
+            documents.append(self._to_document(message))
+
+        self.save_checkpoint({
+            "history_id": profile["historyId"],
+            "synced_at": sync_started_at,
+            "seen_ids": sorted(seen_ids),
+        })
+        return documents
+
+    def load_checkpoint(self) -> Optional[dict]:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, "r") as f:
+            return json.load(f)
+
+    def save_checkpoint(self, checkpoint: dict) -> None:
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _added_message_ids(self, start_history_id) -> Optional[List[str]]:
+        """Ids of messages added since start_history_id, or None if that history has expired."""
+        message_ids = []
+        page_token = None
+        while True:
+            try:
+                results = (
+                    self.service.users()
+                    .history()
+                    .list(
+                        userId="me",
+                        startHistoryId=start_history_id,
+                        historyTypes=["messageAdded"],
+                        pageToken=page_token,
+                    )
+                    .execute()
+                )
+            except Exception as e:
+                # Gmail answers 404 when startHistoryId is too old
+                if getattr(getattr(e, "resp", None), "status", None) == 404:
+                    return None
+                raise
+
+            for record in results.get("history", []):
+                for added in record.get("messagesAdded", []):
+                    message_ids.append(added["message"]["id"])
+
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                return list(dict.fromkeys(message_ids))
+
+    def _filter_by_query(self, message_ids, synced_at) -> List[str]:
+        """Keeps the ids that match the reader's query, only listing mail since the last sync."""
+        # Allow a day of slack, since internal dates and delivery times can disagree
+        query = f"{self.query} after:{synced_at - 86400}"
+        matching_ids = set()
+        page_token = None
+        while True:
+            results = (
+                self.service.users()
+                .messages()
+                .list(userId="me", q=query, pageToken=page_token, maxResults=500)
+                .execute()
+            )
+            matching_ids.update(message["id"] for message in results.get("messages", []))
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+        return [message_id for message_id in message_ids if message_id in matching_ids]
+
+    def _ensure_service(self) -> None:
+        if self.service:
+            return
+
+        from googleapiclient.discovery import build
+
+        credentials = self._get_credentials()
+        self.service = build("gmail", "v1", credentials=credentials)
+        if self.service_factory is None:
+            self.service_factory = lambda: build("gmail", "v1", credentials=credentials)
 
-            results.append(Document(text=text, metadata=metadata or {}))
+    def _to_document(self, message: dict) -> Document:
+        text = message.pop("body")
+        metadata = message
 
-        return results
+        return Document(id_=message["id"], text=text, metadata=metadata or {})
 
     def _get_credentials(self) -> Any:
         """Get valid user credentials from storage.
@@ -91,55 +275,101 @@ class CustomGmailReader(BaseReader, BaseModel):
         return creds
 
     def search_messages(self):
+        result = []
+        for message_data in self.iter_messages():
+            result.append(message_data)
+        return result
+
+    def iter_messages(self) -> Iterator[dict]:
+        """Yields parsed messages matching the query, fetching while the listing is still paging."""
+        try:
+            for message_data in self.fetch_messages(self.iter_message_ids()):
+                if not message_data:
+                    continue
+                yield message_data
+        except Exception as e:
+            raise Exception("Can't get message data" + str(e))
+
+    def iter_message_ids(self) -> Iterator[dict]:
+        """Pages through messages().list, yielding up to max_results message stubs."""
         query = self.query
 
         max_results = self.max_results
         if self.results_per_page:
             max_results = self.results_per_page
 
-        results = (
-            self.service.users()
-            .messages()
-            .list(userId="me", q=query, maxResults=int(max_results))
-            .execute()
-        )
-        messages = results.get("messages", [])
+        listed = 0
+        page_token = None
+        while True:
+            results = (
+                self.service.users()
+                .messages()
+                .list(
+                    userId="me",
+                    q=query,
+                    pageToken=page_token,
+                    maxResults=int(max_results),
+                )
+                .execute()
+            )
+            for message in results.get("messages", []):
+                yield message
+                listed += 1
+                if listed >= self.max_results:
+                    return
 
-        if len(messages) < self.max_results:
             # paginate if there are more results
-            while "nextPageToken" in results:
-                page_token = results["nextPageToken"]
-                results = (
-                    self.service.users()
-                    .messages()
-                    .list(
-                        userId="me",
-                        q=query,
-                        pageToken=page_token,
-                        maxResults=int(max_results),
-                    )
-                    .execute()
-                )
-                messages.extend(results["messages"])
-                if len(messages) >= self.max_results:
-                    break
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                return
+
+    def _thread_service(self):
+        """Returns the Gmail service to use on the current thread."""
+        if self.service_factory is None:
+            return self.service
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = self.service_factory()
+        return service
+
+    def fetch_messages(self, messages: Iterable[dict], skip_missing: bool = False) -> Iterator[dict]:
+        """
+        Fetches and parses messages on a thread pool, yielding them in input order.
 
-        result = []
-        try:
+        At most 2 * max_workers requests are in flight or buffered at a time, so
+        results stream out as they arrive instead of after the whole batch. With
+        skip_missing, messages that no longer exist are yielded as None.
+        """
+        get_message_data = self._get_message_data_if_exists if skip_missing else self.get_message_data
+        # Without a factory every thread would share one service, which the Google API client doesn't allow
+        max_workers = self.max_workers if self.service_factory is not None else 1
+        if max_workers <= 1:
             for message in messages:
-                message_data = self.get_message_data(message)
-                if not message_data:
-                    continue
-                result.append(message_data)
-        except Exception as e:
-            raise Exception("Can't get message data" + str(e))
+                yield get_message_data(message)
+            return
 
-        return result
+        window = 2 * max_workers
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gmail-fetch") as executor:
+            for message in messages:
+                pending.append(executor.submit(get_message_data, message))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _get_message_data_if_exists(self, message):
+        try:
+            return self.get_message_data(message)
+        except Exception as e:
+            if getattr(getattr(e, "resp", None), "status", None) == 404:
+                return None
+            raise
 
     def get_message_data(self, message):
         message_id = message["id"]
         message_data = (
-            self.service.users()
+            self._thread_service().users()
             .messages()
             .get(userId="me", id=message_id, format="full")
             .execute()
@@ -162,25 +392,62 @@ class CustomGmailReader(BaseReader, BaseModel):
         }
 
     def extract_message_body(self, message_data):
-        def get_text(payload):
-            if 'body' in payload:
-                data = payload['body'].get('data')
-                if data:
-                    return base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
-            return ''
-
-        def find_plain_text(payload):
-            if payload.get('mimeType') == 'text/plain':
-                return get_text(payload)
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    text = find_plain_text(part)
-                    if text:
-                        return text
-            return ''
-
-        body = find_plain_text(message_data['payload'])
-        return body if body else ""
+        """
+        Returns the text of the message body.
+
+        Parts are walked iteratively, in document order, and attachments are skipped
+        without being decoded. The first text/plain part is used; HTML-only messages
+        fall back to the first text/html part, converted to text. Only the chosen
+        part is decoded, and at most max_body_chars characters of it.
+        """
+        plain_part = None
+        html_part = None
+
+        stack = [message_data['payload']]
+        while stack and plain_part is None:
+            part = stack.pop()
+            if part.get('parts'):
+                # Reversed, so parts are popped in their original order
+                stack.extend(reversed(part['parts']))
+                continue
+            if self._is_attachment(part):
+                continue
+
+            mime_type = part.get('mimeType')
+            if mime_type == 'text/plain':
+                plain_part = part
+            elif mime_type == 'text/html' and html_part is None:
+                html_part = part
+
+        if plain_part is not None:
+            return self._decode_part(plain_part, self.max_body_chars)
+        if html_part is not None:
+            # Markup usually outweighs the text, so more of an HTML part is decoded
+            html_content = self._decode_part(html_part, self.max_body_chars * HTML_DECODE_FACTOR)
+            return html_to_text(html_content)[:self.max_body_chars]
+        return ""
+
+    def _is_attachment(self, part):
+        body = part.get('body', {})
+        if not body.get('data') or part.get('filename') or body.get('attachmentId'):
+            return True
+        # Text parts are never skipped for size, the body is truncated to max_body_chars when decoded
+        if body.get('size', 0) > self.max_part_size and not (part.get('mimeType') or '').startswith('text/'):
+            return True
+        for header in part.get('headers', []):
+            if header['name'].lower() == 'content-disposition' and header['value'].lower().startswith('attachment'):
+                return True
+        return False
+
+    def _decode_part(self, part, max_chars):
+        data = part['body']['data']
+        # UTF-8 uses at most 4 bytes per character, and base64 encodes 3 bytes in 4 characters
+        max_encoded = (max_chars * 4 // 3 + 4) * 4
+        if len(data) > max_encoded:
+            data = data[:max_encoded - max_encoded % 4]
+        data += '=' * (-len(data) % 4)
+        text = base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+        return text[:max_chars]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+"""
+Local embedding cache shared across index rebuilds and experiment runs.
+
+CachedEmbedding wraps any LlamaIndex embedding model. Vectors are stored in SQLite,
+keyed by (model name, kind, sha256 of the text), so re-embedding an unchanged chunk
+costs a local lookup instead of an API call. Only the misses of each batch are sent
+to the wrapped model, in one batched request.
+
+The cache lives in ~/.cache/codepath_ai/embeddings.sqlite3 by default, so every app
+and lab on the machine shares it. Set EMBEDDING_CACHE_PATH to use a different file.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Any, Dict, List, Optional
+
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "codepath_ai", "embeddings.sqlite3")
+
+# SQLite limits the number of bound parameters per statement
+LOOKUP_CHUNK_SIZE = 500
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite table of float32 vectors keyed by (model, kind, text hash)."""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL lets several processes read the cache while one of them writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, kind, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model, kind, hashes) -> Dict[str, List[float]]:
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        with self._lock:
+            for start in range(0, len(unique_hashes), LOOKUP_CHUNK_SIZE):
+                chunk = unique_hashes[start:start + LOOKUP_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings"
+                    f" WHERE model = ? AND kind = ? AND text_hash IN ({placeholders})",
+                    [model, kind, *chunk],
+                )
+                for row_hash, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[row_hash] = vector.tolist()
+        return found
+
+    def put_many(self, model, kind, items) -> None:
+        """items is an iterable of (text hash, vector) pairs."""
+        rows = [(model, kind, row_hash, array("f", vector).tobytes()) for row_hash, vector in items]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Embedding model that serves repeated texts from an EmbeddingCache.
+
+    Args:
+        inner (BaseEmbedding): The embedding model to call on cache misses.
+        cache_path (str): SQLite file to use. Defaults to EMBEDDING_CACHE_PATH or
+            ~/.cache/codepath_ai/embeddings.sqlite3.
+    """
+
+    inner: BaseEmbedding
+    cache_path: Optional[str] = None
+
+    _cache: EmbeddingCache = PrivateAttr()
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def __init__(self, inner: BaseEmbedding, cache_path: Optional[str] = None, **kwargs: Any) -> None:
+        # Cache lookups are cheap, so large batches let the misses of many chunks share one request
+        kwargs.setdefault("embed_batch_size", 1000)
+        super().__init__(inner=inner, cache_path=cache_path, model_name=inner.model_name, **kwargs)
+        self._cache = EmbeddingCache(cache_path)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self._hits, "misses": self._misses}
+
+    def _lookup(self, kind, texts):
+        hashes = [text_hash(text) for text in texts]
+        found = self._cache.get_many(self.model_name, kind, hashes)
+        missing = {}
+        for text, row_hash in zip(texts, hashes):
+            if row_hash not in found:
+                missing.setdefault(row_hash, text)
+        self._hits += len(texts) - len(missing)
+        self._misses += len(missing)
+        return hashes, found, missing
+
+    def _store(self, kind, found, missing, vectors):
+        new_items = list(zip(missing.keys(), vectors))
+        self._cache.put_many(self.model_name, kind, new_items)
+        found.update(new_items)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        hashes, found, missing = self._lookup("text", texts)
+        if missing:
+            vectors = self.inner.get_text_embedding_batch(list(missing.values()))
+            self._store("text", found, missing, vectors)
+        return [found[row_hash] for row_hash in hashes]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        hashes, found, missing = self._lookup("text", texts)
+        if missing:
+            vectors = await self.inner.aget_text_embedding_batch(list(missing.values()))
+            self._store("text", found, missing, vectors)
+        return [found[row_hash] for row_hash in hashes]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        # Some models embed queries differently from documents, so they're cached separately
+        hashes, found, missing = self._lookup("query", [query])
+        if missing:
+            self._store("query", found, missing, [self.inner.get_query_embedding(query)])
+        return found[hashes[0]]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        hashes, found, missing = self._lookup("query", [query])
+        if missing:
+            self._store("query", found, missing, [await self.inner.aget_query_embedding(query)])
+        return found[hashes[0]]
+
+
+def use_embedding_cache(cache_path=None):
+    """Wraps the globally configured embedding model in a CachedEmbedding."""
+    if not isinstance(Settings.embed_model, CachedEmbedding):
+        Settings.embed_model = CachedEmbedding(inner=Settings.embed_model, cache_path=cache_path)
+    return Settings.embed_model
@@ -0,0 +1,142 @@
+"""
+Concurrent, rate-limited runner for LLM evaluations.
+
+run_items() processes dataset items concurrently, with at most `concurrency` in flight,
+and returns the results in the same order as the items. Model calls go through a
+RateLimiter that enforces requests- and tokens-per-minute limits, and with_retries()
+backs off and retries when the API answers 429 anyway.
+
+The stub query engine and judge at the bottom stand in for the real models, so the
+throughput of the runner can be measured offline (see `python evaluate_rag.py --dry-run`).
+"""
+
+import asyncio
+import random
+import time
+
+import openai
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for requests and tokens per minute.
+
+    Args:
+        requests_per_minute (int): Maximum requests per minute. None for no limit.
+        tokens_per_minute (int): Maximum tokens per minute. None for no limit.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute or 0)
+        self._token_allowance = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed_minutes = (now - self._last_refill) / 60
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_allowance = min(self.requests_per_minute,
+                                          self._request_allowance + elapsed_minutes * self.requests_per_minute)
+        if self.tokens_per_minute:
+            self._token_allowance = min(self.tokens_per_minute,
+                                        self._token_allowance + elapsed_minutes * self.tokens_per_minute)
+
+    def _wait_time(self, tokens, requests):
+        wait = 0.0
+        if self.requests_per_minute:
+            requests = min(requests, self.requests_per_minute)
+            if self._request_allowance < requests:
+                wait = max(wait, (requests - self._request_allowance) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute:
+            # A request larger than the whole budget waits for a full bucket, not forever
+            tokens = min(tokens, self.tokens_per_minute)
+            if self._token_allowance < tokens:
+                wait = max(wait, (tokens - self._token_allowance) * 60 / self.tokens_per_minute)
+        return wait
+
+    async def acquire(self, tokens=0, requests=1):
+        # Callers queue on the lock, so capacity is handed out in arrival order
+        async with self._lock:
+            self._refill()
+            while (wait := self._wait_time(tokens, requests)) > 0:
+                await asyncio.sleep(wait)
+                self._refill()
+            if self.requests_per_minute:
+                self._request_allowance -= min(requests, self.requests_per_minute)
+            if self.tokens_per_minute:
+                self._token_allowance -= min(tokens, self.tokens_per_minute)
+
+
+def estimate_tokens(text, max_output_tokens=0):
+    """Rough token estimate (four characters per token) used for rate limiting."""
+    return len(text) // 4 + max_output_tokens
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def with_retries(call, *args, max_retries=5, base_delay=1.0, max_delay=60.0, **kwargs):
+    """Awaits call(*args, **kwargs), retrying with exponential backoff and jitter on 429s."""
+    for attempt in range(max_retries + 1):
+        try:
+            return await call(*args, **kwargs)
+        except openai.RateLimitError as e:
+            if attempt == max_retries:
+                raise
+            delay = _retry_after(e) or min(max_delay, base_delay * 2 ** attempt)
+            await asyncio.sleep(delay * (1 + random.random() * 0.25))
+
+
+async def run_items(items, process_item, concurrency=8):
+    """
+    Runs process_item(index, item) for every item with bounded concurrency.
+
+    Returns the results in item order, regardless of completion order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(index, item):
+        async with semaphore:
+            return await process_item(index, item)
+
+    return await asyncio.gather(*(run_one(index, item) for index, item in enumerate(items)))
+
+
+class StubResponse:
+    def __init__(self, response):
+        self.response = response
+
+
+class StubQueryEngine:
+    """
+    Stands in for a query engine; answers with the question after a simulated delay.
+
+    Like the real engine, it doesn't rate limit itself: rag_query() acquires the limiter
+    for both, so a dry run makes the same requests as a real run.
+    """
+
+    def __init__(self, latency=0.5):
+        self.latency = latency
+
+    async def aquery(self, query):
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        return StubResponse(f"Stub answer to: {query}")
+
+
+async def stub_judge(output, expected_output, latency=0.5, limiter=None):
+    """Stands in for the LLM judge; returns a random score after a simulated delay."""
+    if limiter:
+        await limiter.acquire(estimate_tokens(output + expected_output, 100))
+    await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+    return random.randint(0, 1), "Stub evaluation"
@@ -2,30 +2,48 @@ from langfuse import Langfuse
 import openai
 from dotenv import load_dotenv
 from llama_index.core import VectorStoreIndex, SimpleDirectoryReader
+import argparse
+import asyncio
+import json
 import os
+import time
+
+from embedding_cache import use_embedding_cache
+from eval_runner import RateLimiter, StubQueryEngine, estimate_tokens, run_items, stub_judge, with_retries
 
 load_dotenv()
 
-# Load documents from a directory (you can change this path as needed)
-documents = SimpleDirectoryReader("data").load_data()
+EVAL_MODEL = "gpt-3.5-turbo"
+
+# A query sends the retrieved context (two chunks of up to 1024 tokens by default) and gets an answer back
+QUERY_CONTEXT_TOKENS = 2 * 1024
+QUERY_OUTPUT_TOKENS = 256
+# Embedding the question, then generating the answer
+QUERY_REQUESTS = 2
+
+def build_query_engine():
+  # Chunks of an unchanged PDF are served from the local cache instead of being re-embedded
+  use_embedding_cache()
+
+  # Load documents from a directory (you can change this path as needed)
+  documents = SimpleDirectoryReader("data").load_data()
 
-# Create an index from the documents
-index = VectorStoreIndex.from_documents(documents)
+  # Create an index from the documents
+  index = VectorStoreIndex.from_documents(documents)
 
-# Create a query engine
-query_engine = index.as_query_engine()
+  # Create a query engine
+  return index.as_query_engine()
 
-langfuse = Langfuse(
-  public_key= os.getenv("LANGFUSE_PUBLIC_KEY"),
-  secret_key= os.getenv("LANGFUSE_SECRET_KEY"),
-  host="https://us.cloud.langfuse.com"
-)
+def build_langfuse():
+  return Langfuse(
+    public_key= os.getenv("LANGFUSE_PUBLIC_KEY"),
+    secret_key= os.getenv("LANGFUSE_SECRET_KEY"),
+    host="https://us.cloud.langfuse.com"
+  )
 
 # we use a very simple eval here, you can use any eval library
 # see https://langfuse.com/docs/scores/model-based-evals for details
-def llm_evaluation(output, expected_output):
-    client = openai.OpenAI()
-
+async def llm_evaluation(client, limiter, output, expected_output):
     prompt = f"""
     Compare the following output with the expected output and evaluate its accuracy:
 
@@ -40,59 +58,112 @@ def llm_evaluation(output, expected_output):
     }}
     """
 
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
+    await limiter.acquire(estimate_tokens(prompt, 100))
+    response = await with_retries(
+        client.chat.completions.create,
+        model=EVAL_MODEL,
         messages=[
             {"role": "system", "content": "You are an AI assistant tasked with evaluating the accuracy of responses."},
             {"role": "user", "content": prompt}
         ],
+        response_format={"type": "json_object"},
         temperature=0.2
     )
 
     evaluation = response.choices[0].message.content
-    result = eval(evaluation)  # Convert the JSON string to a Python dictionary
-
-    # Debug printout
-    print(f"Output: {output}")
-    print(f"Expected Output: {expected_output}")
-    print(f"Evaluation Result: {result}")
+    result = json.loads(evaluation)
 
     return result["score"], result["reason"]
 
 from datetime import datetime
 
-def rag_query(input):
+async def rag_query(query_engine, langfuse, limiter, input):
 
   generationStartTime = datetime.now()
 
-  response = query_engine.query(input)
+  # The query embeds the question and calls the LLM, so it counts as two requests against the limits
+  await limiter.acquire(estimate_tokens(input, QUERY_CONTEXT_TOKENS + QUERY_OUTPUT_TOKENS), requests=QUERY_REQUESTS)
+  response = await with_retries(query_engine.aquery, input)
   output = response.response
-  print(output)
-
-  langfuse_generation = langfuse.generation(
-    name="strategic-plan-qa",
-    input=input,
-    output=output,
-    model="gpt-3.5-turbo",
-    start_time=generationStartTime,
-    end_time=datetime.now()
-  )
 
-  return output, langfuse_generation
-
-def run_experiment(experiment_name):
-  dataset = langfuse.get_dataset("strategic_plan_qa_pairs")
-
-  for item in dataset.items:
-    completion, langfuse_generation = rag_query(item.input)
-
-    item.link(langfuse_generation, experiment_name) # pass the observation/generation object or the id
-
-    score, reason = llm_evaluation(completion, item.expected_output)
-    langfuse_generation.score(
-      name="accuracy",
-      value=score,
-      comment=reason
+  langfuse_generation = None
+  if langfuse:
+    langfuse_generation = langfuse.generation(
+      name="strategic-plan-qa",
+      input=input,
+      output=output,
+      model=EVAL_MODEL,
+      start_time=generationStartTime,
+      end_time=datetime.now()
     )
 
-run_experiment("Experiment 2")
+  return output, langfuse_generation
+
+async def run_experiment(experiment_name, concurrency=8, requests_per_minute=None, tokens_per_minute=None,
+                         dry_run=False, stub_latency=0.5):
+  limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+  if dry_run:
+    # Benchmark the runner offline against stub models and the local copy of the dataset
+    with open("qa_dataset.json", "r") as f:
+      items = [{"input": pair["question"], "expected_output": pair["expected_output"]} for pair in json.load(f)]
+    query_engine = StubQueryEngine(stub_latency)
+    langfuse = None
+
+    async def judge(output, expected_output):
+      return await stub_judge(output, expected_output, stub_latency, limiter)
+  else:
+    langfuse = build_langfuse()
+    items = langfuse.get_dataset("strategic_plan_qa_pairs").items
+    query_engine = build_query_engine()
+    client = openai.AsyncOpenAI()
+
+    async def judge(output, expected_output):
+      return await llm_evaluation(client, limiter, output, expected_output)
+
+  async def evaluate_item(index, item):
+    item_input = item["input"] if dry_run else item.input
+    expected_output = item["expected_output"] if dry_run else item.expected_output
+
+    completion, langfuse_generation = await rag_query(query_engine, langfuse, limiter, item_input)
+    score, reason = await judge(completion, expected_output)
+
+    if langfuse_generation:
+      # The Langfuse client calls are blocking, so keep them off the event loop
+      await asyncio.to_thread(item.link, langfuse_generation, experiment_name)
+      await asyncio.to_thread(langfuse_generation.score, name="accuracy", value=score, comment=reason)
+
+    return {"input": item_input, "output": completion, "expected_output": expected_output,
+            "score": score, "reason": reason}
+
+  start_time = time.monotonic()
+  results = await run_items(items, evaluate_item, concurrency=concurrency)
+  elapsed = time.monotonic() - start_time
+
+  # Results come back in dataset order, so the printout is the same on every run
+  for result in results:
+    print(f"Output: {result['output']}")
+    print(f"Expected Output: {result['expected_output']}")
+    print(f"Evaluation Result: {{'score': {result['score']}, 'reason': {result['reason']!r}}}")
+
+  if langfuse:
+    langfuse.flush()
+
+  accuracy = sum(result["score"] for result in results) / len(results) if results else 0
+  print(f"{len(results)} items in {elapsed:.1f}s ({len(results) / elapsed:.1f} items/s), accuracy {accuracy:.2%}")
+  return results
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Run a RAG evaluation experiment.")
+  parser.add_argument("--experiment", default="Experiment 2", help="Name of the Langfuse experiment run.")
+  parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of items evaluated at once.")
+  parser.add_argument("--rpm", type=int, default=None,
+                      help="Requests per minute limit, shared by the RAG queries (two requests each) and the judge.")
+  parser.add_argument("--tpm", type=int, default=None,
+                      help="Tokens per minute limit, shared by the RAG queries and the judge.")
+  # Embedding and chat requests count against the same limits, which is stricter than the API's per-model limits
+  parser.add_argument("--dry-run", action="store_true", help="Use local stub models instead of the APIs.")
+  parser.add_argument("--stub-latency", type=float, default=0.5, help="Average latency of each stub call, in seconds.")
+  args = parser.parse_args()
+
+  asyncio.run(run_experiment(args.experiment, args.concurrency, args.rpm, args.tpm, args.dry_run, args.stub_latency))
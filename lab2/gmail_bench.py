@@ -0,0 +1,308 @@
+"""
+Benchmarks for CustomGmailReader against a local fake Gmail service.
+
+FakeGmailService answers the same calls as the Google API client
+(`users().messages().list/get(...).execute()`, `users().history().list(...)` and
+`users().getProfile(...)`) from an in-memory mailbox, sleeping for a configurable
+latency per request to simulate the network round trip.
+
+    python gmail_bench.py --messages 500 --latency 0.05
+
+The body extraction micro-benchmark runs over a directory of recorded payloads, one
+`messages().get(format="full")` response per .json file, or over a synthetic corpus
+of plain, HTML-only and attachment-heavy messages when no directory is given.
+
+    python gmail_bench.py --payloads recorded_payloads/
+"""
+
+import argparse
+import base64
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+def make_message(index):
+    body = f"This is the body of message {index}.\n" * 20
+    return {
+        "id": f"msg{index:06d}",
+        "threadId": f"thread{index:06d}",
+        "snippet": body[:100],
+        "internalDate": str(1700000000000 + index * 1000),
+        "payload": {
+            "mimeType": "multipart/alternative",
+            "headers": [
+                {"name": "From", "value": "sender@example.com"},
+                {"name": "To", "value": "me@example.com"},
+                {"name": "Subject", "value": f"Message {index}"},
+                {"name": "Date", "value": "Mon, 1 Jan 2024 00:00:00 +0000"},
+            ],
+            "parts": [
+                {
+                    "mimeType": "text/plain",
+                    "body": {"data": base64.urlsafe_b64encode(body.encode()).decode(), "size": len(body)},
+                },
+            ],
+        },
+    }
+
+
+def encode(text):
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def synthetic_payloads():
+    """A small corpus covering the shapes of mail that matter for body extraction."""
+    plain = "Plain text line with some words in it.\n" * 50
+    newsletter = ("<html><head><style>p { color: red; }</style></head><body>"
+                  + "<div><p>Newsletter paragraph with <a href='#'>a link</a> &amp; entities.</p></div>" * 200
+                  + "</body></html>")
+    attachment = "A" * 3_000_000
+
+    def message(payload):
+        return {"id": "synthetic", "threadId": "synthetic", "payload": payload}
+
+    return [
+        message({"mimeType": "text/plain", "headers": [], "body": {"data": encode(plain), "size": len(plain)}}),
+        message({"mimeType": "multipart/alternative", "headers": [], "parts": [
+            {"mimeType": "text/plain", "headers": [], "body": {"data": encode(plain), "size": len(plain)}},
+            {"mimeType": "text/html", "headers": [], "body": {"data": encode(newsletter), "size": len(newsletter)}},
+        ]}),
+        message({"mimeType": "text/html", "headers": [], "body": {"data": encode(newsletter), "size": len(newsletter)}}),
+        message({"mimeType": "multipart/mixed", "headers": [], "parts": [
+            {"mimeType": "text/plain", "filename": "data.txt", "headers": [
+                {"name": "Content-Disposition", "value": "attachment; filename=data.txt"}],
+             "body": {"data": encode(attachment), "size": len(attachment)}},
+            {"mimeType": "multipart/alternative", "headers": [], "parts": [
+                {"mimeType": "text/html", "headers": [],
+                 "body": {"data": encode(newsletter), "size": len(newsletter)}},
+            ]},
+        ]}),
+    ]
+
+
+def legacy_extract_message_body(message_data):
+    """The recursive, text/plain-only extraction the reader used before, for comparison."""
+    def get_text(payload):
+        if 'body' in payload:
+            data = payload['body'].get('data')
+            if data:
+                return base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+        return ''
+
+    def find_plain_text(payload):
+        if payload.get('mimeType') == 'text/plain':
+            return get_text(payload)
+        if 'parts' in payload:
+            for part in payload['parts']:
+                text = find_plain_text(part)
+                if text:
+                    return text
+        return ''
+
+    return find_plain_text(message_data['payload'])
+
+
+def bench_extract(payloads_dir, iterations):
+    from custom_gmail_reader import CustomGmailReader
+
+    if payloads_dir:
+        payloads = []
+        for path in sorted(glob.glob(os.path.join(payloads_dir, "*.json"))):
+            with open(path, "r") as f:
+                payloads.append(json.load(f))
+    else:
+        payloads = synthetic_payloads()
+
+    reader = CustomGmailReader(query="", service=None, results_per_page=None)
+    for name, extract in (("legacy", legacy_extract_message_body), ("current", reader.extract_message_body)):
+        start = time.perf_counter()
+        total_chars = 0
+        empty = 0
+        for _ in range(iterations):
+            for payload in payloads:
+                body = extract(payload)
+                total_chars += len(body)
+                empty += not body
+        elapsed = time.perf_counter() - start
+        print(f"extract {name:7s}: {len(payloads) * iterations} bodies  {elapsed * 1000:.1f}ms  "
+              f"{total_chars // iterations} chars/pass  {empty // iterations} empty/pass")
+
+
+class FakeHttpError(Exception):
+    """Mimics googleapiclient.errors.HttpError, which carries the status on `resp`."""
+
+    class Response:
+        def __init__(self, status):
+            self.status = status
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = self.Response(status)
+
+
+class FakeRequest:
+    def __init__(self, service, handler):
+        self.service = service
+        self.handler = handler
+
+    def execute(self):
+        with self.service.lock:
+            self.service.requests += 1
+        time.sleep(self.service.latency)
+        return self.handler()
+
+
+class FakeMessages:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId, q=None, maxResults=100, pageToken=None, **kwargs):
+        def handler():
+            start = int(pageToken or 0)
+            ids = self.service.message_ids[start:start + maxResults]
+            result = {"messages": [{"id": message_id, "threadId": message_id} for message_id in ids]}
+            if start + maxResults < len(self.service.message_ids):
+                result["nextPageToken"] = str(start + maxResults)
+            return result
+        return FakeRequest(self.service, handler)
+
+    def get(self, userId, id, format="full", **kwargs):
+        def handler():
+            if id not in self.service.mailbox:
+                raise FakeHttpError(404)
+            return self.service.mailbox[id]
+        return FakeRequest(self.service, handler)
+
+
+class FakeHistory:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId, startHistoryId, historyTypes=None, pageToken=None, maxResults=100, **kwargs):
+        def handler():
+            start_history_id = int(startHistoryId)
+            if start_history_id < self.service.oldest_history_id:
+                raise FakeHttpError(404)
+            records = [record for record in self.service.history if int(record["id"]) > start_history_id]
+            start = int(pageToken or 0)
+            result = {"history": records[start:start + maxResults], "historyId": str(self.service.history_id)}
+            if start + maxResults < len(records):
+                result["nextPageToken"] = str(start + maxResults)
+            return result
+        return FakeRequest(self.service, handler)
+
+
+class FakeUsers:
+    def __init__(self, service):
+        self.service = service
+
+    def messages(self):
+        return FakeMessages(self.service)
+
+    def history(self):
+        return FakeHistory(self.service)
+
+    def getProfile(self, userId):
+        return FakeRequest(self.service, lambda: {"historyId": str(self.service.history_id)})
+
+
+class FakeGmailService:
+    """Thread-safe, in-memory stand-in for the Gmail API client."""
+
+    def __init__(self, messages=100, latency=0.05):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.mailbox = {}
+        self.message_ids = []
+        self.history = []
+        self.history_id = 1000
+        self.oldest_history_id = self.history_id
+        for index in range(messages):
+            self.add_message(make_message(index))
+
+    def add_message(self, message):
+        self.mailbox[message["id"]] = message
+        # Gmail lists the newest messages first
+        self.message_ids.insert(0, message["id"])
+        self.history_id += 1
+        self.history.append({"id": str(self.history_id), "messagesAdded": [{"message": {"id": message["id"]}}]})
+
+    def users(self):
+        return FakeUsers(self)
+
+
+def bench_fetch(messages, latency, workers):
+    from custom_gmail_reader import CustomGmailReader
+
+    service = FakeGmailService(messages, latency)
+    reader = CustomGmailReader(query="", max_results=messages, results_per_page=100,
+                               service=service, service_factory=lambda: service, max_workers=workers)
+    start = time.perf_counter()
+    documents = reader.load_data()
+    elapsed = time.perf_counter() - start
+    print(f"workers={workers:3d}  {len(documents)} documents  {service.requests} requests  {elapsed:.2f}s")
+
+
+def bench_lazy(messages, latency):
+    from custom_gmail_reader import CustomGmailReader
+
+    service = FakeGmailService(messages, latency)
+    reader = CustomGmailReader(query="", max_results=messages, results_per_page=100, service=service,
+                               service_factory=lambda: service)
+    start = time.perf_counter()
+    first_document_at = None
+    count = 0
+    for _ in reader.lazy_load_data():
+        if first_document_at is None:
+            first_document_at = time.perf_counter() - start
+        count += 1
+    print(f"lazy load: {count} documents  first after {first_document_at:.2f}s  "
+          f"all after {time.perf_counter() - start:.2f}s")
+
+
+def bench_sync(messages, latency, new_messages):
+    from custom_gmail_reader import CustomGmailReader
+
+    service = FakeGmailService(messages, latency)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        reader = CustomGmailReader(query="", max_results=messages, results_per_page=100, service=service,
+                                   service_factory=lambda: service, checkpoint_path=os.path.join(tmp_dir, "checkpoint.json"))
+        start = time.perf_counter()
+        documents = reader.sync_data()
+        print(f"initial sync: {len(documents)} documents  {service.requests} requests  "
+              f"{time.perf_counter() - start:.2f}s")
+
+        for index in range(messages, messages + new_messages):
+            service.add_message(make_message(index))
+        service.requests = 0
+        start = time.perf_counter()
+        documents = reader.sync_data()
+        print(f"incremental sync: {len(documents)} documents  {service.requests} requests  "
+              f"{time.perf_counter() - start:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CustomGmailReader against a fake Gmail service.")
+    parser.add_argument("--messages", type=int, default=200, help="Number of messages in the fake mailbox.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated latency of each request, in seconds.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32], help="Thread pool sizes to compare.")
+    parser.add_argument("--new-messages", type=int, default=10, help="Messages added before the incremental sync.")
+    parser.add_argument("--payloads", default=None, help="Directory of recorded message payloads (.json).")
+    parser.add_argument("--iterations", type=int, default=20, help="Passes over the payloads when extracting.")
+    args = parser.parse_args()
+
+    bench_extract(args.payloads, args.iterations)
+
+    for workers in args.workers:
+        bench_fetch(args.messages, args.latency, workers)
+    bench_lazy(args.messages, args.latency)
+    bench_sync(args.messages, args.latency, args.new_messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 from dotenv import load_dotenv
 import chainlit as cl
+import asyncio
 import json
+import re
+from functools import lru_cache
 load_dotenv()
 
 # Note: If switching to LangSmith, uncomment the following, and replace @observe with @traceable
@@ -11,7 +14,11 @@ load_dotenv()
 from langfuse.decorators import observe
 from langfuse.openai import AsyncOpenAI
 
-from movie_functions import get_now_playing_movies, get_showtimes, buy_ticket, get_reviews
+from movie_functions import (
+    get_now_playing_movies_async, get_showtimes_async, buy_ticket_async, get_reviews_async, get_now_playing_catalog_async,
+    get_cache_stats
+)
+from history import build_prompt
 
 client = AsyncOpenAI()
 
@@ -21,30 +28,92 @@ gen_kwargs = {
     "max_tokens": 500
 }
 
-SYSTEM_PROMPT = """\
-You are a helpful assistant that can sometimes answer questions about movies, including what's playing, showtimes,
-buy tickets and get reviews.
+# The review classifier only returns a small JSON decision, so a smaller model answers it quickly
+review_gen_kwargs = {
+    "model": "gpt-4o-mini",
+    "temperature": 0,
+    "max_tokens": 150,
+    "response_format": {"type": "json_object"}
+}
 
-You have four functions available to you:
-* get_now_playing_movies - shows what's currently playing. No input required.
-* get_showtimes - what are the showtimes for a specific movie. This requires two inputs, the movies and the user's location.
-* buy_ticket - this allows the user to buy a ticket. It requires a specific theater, movie, and showtime.
-* get_reviews - this gets specific reviews on a movie. This requires the id of the movie.
+# Maximum number of prompt tokens sent per request; older turns beyond it are dropped
+HISTORY_TOKEN_BUDGET = 16000
 
-If you believe a function call would be helpful, then output the name of the function and an explanation for why you're calling.
+# Rounds of tool calls allowed per user message, so a model that keeps calling tools can't loop forever
+MAX_TOOL_ROUNDS = 5
 
-When calling a function, you should only output the following json object:
-{
-    "function_name": "function_name",
-    "parameters": [param1, param2],
-    "rationale": "explanation"
-}
+SYSTEM_PROMPT = """\
+You are a helpful assistant that can sometimes answer questions about movies, including what's playing, showtimes,
+buy tickets and get reviews. Use the tools available to you when they would help answer the user.
 
 However before buying a ticket, you should first confirm with the user that they want to buy and list out the details: theater, movie, and showtime.
 
 If you encounter errors, report the issue to the user.
 """
 
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_now_playing_movies",
+            "description": "Shows the movies currently playing in theaters.",
+            "parameters": {"type": "object", "properties": {}},
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_showtimes",
+            "description": "Gets the showtimes for a specific movie near the user's location.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string", "description": "Title of the movie."},
+                    "location": {"type": "string", "description": "The user's location, e.g. a city or zip code."},
+                },
+                "required": ["title", "location"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "buy_ticket",
+            "description": "Buys a ticket. Only call this after the user has confirmed the theater, movie and showtime.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "theater": {"type": "string"},
+                    "movie": {"type": "string"},
+                    "showtime": {"type": "string"},
+                },
+                "required": ["theater", "movie", "showtime"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_reviews",
+            "description": "Gets reviews of a movie from TMDb.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "movie_id": {"type": "integer", "description": "TMDb id of the movie, from the now playing list."},
+                },
+                "required": ["movie_id"],
+            },
+        },
+    },
+]
+
+TOOL_FUNCTIONS = {
+    "get_now_playing_movies": get_now_playing_movies_async,
+    "get_showtimes": get_showtimes_async,
+    "buy_ticket": buy_ticket_async,
+    "get_reviews": get_reviews_async,
+}
+
 REVIEW_SYSTEM_PROMPT = """\
 Based on the conversation, determine if the topic is about a specific movie.
 Determine if the user is asking a question that would be aided by knowing what critics are saying about the movie.
@@ -53,37 +122,107 @@ Determine if the reviews for that movie have already been provided in the conver
 Your only role is to evaluate the conversation, and decide whether to fetch reviews.
 
 Output the current movie, id, a boolean to fetch reviews in JSON format, and your
-rationale. Do not output as a code block. The ID can be found from the list of movies in the conversation.
+rationale. Do not output as a code block. The ID can be found from the list of movies below.
 
 {
     "movie": "title",
     "id": id of the movie as a int,
-    "fetch_reviews": true
+    "fetch_reviews": true,
     "rationale": "reasoning"
 }
 """
 
-movies_context = ""
-
 @observe
 @cl.on_chat_start
 def on_chat_start():
     message_history = [{"role": "system", "content": SYSTEM_PROMPT}]
     cl.user_session.set("message_history", message_history)
+    # Movies shown to this user so far, by TMDb id
+    cl.user_session.set("movie_catalog", {})
+    # Classifier decisions by user message, and the ids of movies whose reviews are already in the history
+    cl.user_session.set("review_decisions", {})
+    cl.user_session.set("reviewed_movies", set())
 
 @observe
-async def generate_response(client, message_history, gen_kwargs):
+async def generate_response(client, message_history, gen_kwargs, tools=None):
     response_message = cl.Message(content="")
-    await response_message.send()
-
-    stream = await client.chat.completions.create(messages=message_history, stream=True, **gen_kwargs)
+    # Only shown once text arrives, so turns that just call tools don't leave an empty message
+    sent = False
+    # Tool calls are accumulated by index, since their name and arguments arrive in fragments
+    tool_calls = {}
+
+    messages, prompt_metrics = build_prompt(message_history, HISTORY_TOKEN_BUDGET)
+    print("Prompt metrics:", prompt_metrics)
+    if tools:
+        gen_kwargs = {**gen_kwargs, "tools": tools}
+    stream = await client.chat.completions.create(messages=messages, stream=True, **gen_kwargs)
     async for part in stream:
-        if token := part.choices[0].delta.content or "":
+        if not part.choices:
+            continue
+        delta = part.choices[0].delta
+        if token := delta.content or "":
+            if not sent:
+                await response_message.send()
+                sent = True
             await response_message.stream_token(token)
+        for tool_call_delta in delta.tool_calls or []:
+            tool_call = tool_calls.setdefault(
+                tool_call_delta.index,
+                {"id": "", "type": "function", "function": {"name": "", "arguments": ""}},
+            )
+            if tool_call_delta.id:
+                tool_call["id"] = tool_call_delta.id
+            if tool_call_delta.function:
+                tool_call["function"]["name"] += tool_call_delta.function.name or ""
+                tool_call["function"]["arguments"] += tool_call_delta.function.arguments or ""
+
+    if sent:
+        await response_message.update()
+
+    return response_message, [tool_calls[index] for index in sorted(tool_calls)]
+
+async def call_tool(tool_call):
+    name = tool_call["function"]["name"]
+    print(name)
+    function = TOOL_FUNCTIONS.get(name)
+    if function is None:
+        return f"Unknown function: {name}"
+    try:
+        arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+    except json.JSONDecodeError:
+        return f"Invalid arguments for {name}"
+
+    try:
+        result = await function(**arguments)
+    except TypeError as e:
+        return f"Invalid arguments for {name}: {e}"
+    except Exception as e:
+        # One failing tool shouldn't abort the others running in the same turn
+        print(f"{name} failed: ", e)
+        return f"Error running {name}: {e}"
+
+    if name == "get_now_playing_movies":
+        # Served from the response cache, the tool call just fetched the same list
+        cl.user_session.get("movie_catalog").update(await get_now_playing_catalog_async())
+    elif name == "get_reviews":
+        cl.user_session.get("reviewed_movies").add(str(arguments["movie_id"]))
+    return result
+
+async def fetch_needed_reviews(review_task):
+    """Awaits the review classifier and returns the reviews it asks for, unless they're already in the history."""
+    decision = await review_task
+    print("should_fetch_reviews: ", decision)
+    if not decision or not decision.get("fetch_reviews") or decision.get("id") is None:
+        return None
 
-    await response_message.update()
+    reviewed_movies = cl.user_session.get("reviewed_movies")
+    movie_id = str(decision["id"])
+    if movie_id in reviewed_movies:
+        return None
+    reviewed_movies.add(movie_id)
 
-    return response_message
+    reviews = await get_reviews_async(movie_id)
+    return f"Reviews for {decision.get('movie', movie_id)} (id {movie_id}):\n{reviews}"
 
 @cl.on_message
 @observe
@@ -91,84 +230,115 @@ async def on_message(message: cl.Message):
     message_history = cl.user_session.get("message_history", [])
     message_history.append({"role": "user", "content": message.content})
 
-    response_message = await generate_response(client, message_history, gen_kwargs)
-
-    should_fetch_reviews_response = await should_fetch_reviews(message_history)
-    print("should_fetch_reviews: ", should_fetch_reviews_response)
-
-    # Check if the response is a function call
-    while response_message.content.strip().startswith('{'):
-        try:
-            # Parse the JSON object
-            function_call = json.loads(response_message.content.strip())
-
-            # Check if it's a valid function call
-            if "function_name" in function_call and "rationale" in function_call:
-                function_name = function_call["function_name"]
-
-                # Handle the function call
-                if function_name == "get_now_playing_movies":
-                    print("get_now_playing_movies")
-                    movies = get_now_playing_movies()
-                    global movies_context
-                    movies_context = movies
-                    message_history.append({"role": "system", "content": f"movies: {movies}"})
-
-                    # Generate a new response based on the function call result
-                    response_message = await generate_response(client, message_history, gen_kwargs)
-                elif function_name == "get_showtimes":
-                    print("get_showtimes")
-                    parameters = function_call["parameters"]
-                    showtimes = get_showtimes(*parameters)
-                    message_history.append({"role": "system", "content": f"{showtimes}"})
-
-                    # Generate a new response based on the function call result
-                    response_message = await generate_response(client, message_history, gen_kwargs)
-                elif function_name == "buy_ticket":
-                    print("buy_ticket")
-                    parameters = function_call["parameters"]
-                    ticket = buy_ticket(*parameters)
-                    message_history.append({"role": "system", "content": f"{ticket}"})
-
-                    # Generate a new response based on the function call result
-                    response_message = await generate_response(client, message_history, gen_kwargs)
-                elif function_name == "get_reviews":
-                    print("get_reviews")
-                    parameters = function_call["parameters"]
-                    reviews = get_reviews(*parameters)
-                    message_history.append({"role": "system", "content": f"{reviews}"})
-
-                    # Generate a new response based on the function call result
-                    response_message = await generate_response(client, message_history, gen_kwargs)
-                else:
-                    # Handle unknown function calls
-                    error_message = f"Unknown function: {function_name}"
-                    message_history.append({"role": "system", "content": error_message})
-                    response_message = await cl.Message(content=error_message).send()
-            else:
-                # Handle invalid function call format
-                error_message = "Invalid function call format"
-                message_history.append({"role": "system", "content": error_message})
-                response_message = await cl.Message(content=error_message).send()
-        except json.JSONDecodeError:
-            # If it's not valid JSON, treat it as a normal message
-            pass
+    # The classifier runs in the background while the answer streams, instead of after it
+    review_task = asyncio.create_task(should_fetch_reviews(message.content))
+
+    response_message, tool_calls = await generate_response(client, message_history, gen_kwargs, TOOLS)
+    reviews_checked = False
+
+    tool_rounds = 0
+    while tool_calls and tool_rounds < MAX_TOOL_ROUNDS:
+        tool_rounds += 1
+        message_history.append({"role": "assistant", "content": response_message.content or None, "tool_calls": tool_calls})
+
+        # Independent tools requested in the same turn run concurrently
+        results = await asyncio.gather(*(call_tool(tool_call) for tool_call in tool_calls))
+        for tool_call, result in zip(tool_calls, results):
+            message_history.append({"role": "tool", "tool_call_id": tool_call["id"], "content": result})
+        print("Cache stats:", get_cache_stats())
+
+        # A follow-up generation is needed anyway, so any reviews the classifier asked for go into it
+        if not reviews_checked:
+            reviews_checked = True
+            reviews = await fetch_needed_reviews(review_task)
+            if reviews:
+                message_history.append({"role": "system", "content": reviews})
+
+        # After MAX_TOOL_ROUNDS the model has to answer with the results it has
+        round_kwargs = gen_kwargs if tool_rounds < MAX_TOOL_ROUNDS else {**gen_kwargs, "tool_choice": "none"}
+        response_message, tool_calls = await generate_response(client, message_history, round_kwargs, TOOLS)
 
     message_history.append({"role": "assistant", "content": response_message.content})
+
+    if not reviews_checked:
+        # The answer needed no tools, so rather than regenerating it, the reviews are kept for the next turn
+        reviews = await fetch_needed_reviews(review_task)
+        if reviews:
+            message_history.append({"role": "system", "content": reviews})
+
     cl.user_session.set("message_history", message_history)
 
 @observe
-async def should_fetch_reviews(message_history):
-    global movies_context
-    message_history = [{"role": "system", "content": movies_context + " " + REVIEW_SYSTEM_PROMPT}, {"role": "user", "content": message_history[-1]["content"]}]
+async def should_fetch_reviews(user_message):
+    # Reviews are looked up by the ids from the now playing list, so there's nothing to decide before it's shown
+    movie_catalog = cl.user_session.get("movie_catalog")
+    if not movie_catalog:
+        return None
 
-    response_message = await generate_response(client, message_history, gen_kwargs)
+    review_decisions = cl.user_session.get("review_decisions")
+    if user_message in review_decisions:
+        return review_decisions[user_message]
 
-    if response_message.content.strip().startswith('{'):
-        return json.loads(response_message.content.strip())
-    else:
+    # Messages naming only movies whose reviews are already in the history don't need a decision
+    current_movie = cl.user_session.get("current_movie")
+    movie_ids = [movie["id"] for movie in named_movies(movie_catalog, user_message)]
+    reviewed_movies = cl.user_session.get("reviewed_movies")
+    if movie_ids and all(str(movie_id) in reviewed_movies for movie_id in movie_ids):
         return None
 
+    movies = relevant_movies(movie_catalog, user_message, current_movie)
+    movie_list = "\n".join(f"{movie['id']}: {movie['title']}" for movie in movies)
+    messages = [
+        {"role": "system", "content": f"{REVIEW_SYSTEM_PROMPT}\nMovies:\n{movie_list}"},
+        {"role": "user", "content": user_message}
+    ]
+    try:
+        response = await client.chat.completions.create(messages=messages, **review_gen_kwargs)
+        decision = json.loads(response.choices[0].message.content)
+    except Exception as e:
+        # The classifier is only an optimization, so a failure shouldn't break the turn
+        print("should_fetch_reviews failed: ", e)
+        return None
+
+    review_decisions[user_message] = decision
+    if decision.get("id") in movie_catalog:
+        cl.user_session.set("current_movie", decision["id"])
+    return decision
+
+@lru_cache(maxsize=1024)
+def title_pattern(title):
+    """
+    Matches the title as whole words, or just its first part, since "Deadpool & Wolverine"
+    or "Dune: Part Two" are often called "Deadpool" or "Dune".
+    """
+    names = {title}
+    first_part = re.split(r"\s*(?::|&| - | – )\s*", title)[0].strip()
+    if len(first_part) >= 4:
+        names.add(first_part)
+    alternatives = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+    # Short titles like "It" or "Up" are common words, so they only match as written
+    flags = re.IGNORECASE if len(title) > 3 else 0
+    return re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)", flags)
+
+def named_movies(movie_catalog, user_message):
+    """The catalog movies whose titles appear in the message."""
+    return [movie for movie in movie_catalog.values() if title_pattern(movie["title"]).search(user_message)]
+
+def relevant_movies(movie_catalog, user_message, current_movie=None):
+    """
+    The movies named in the message plus the one being discussed. If the message names
+    none, the whole catalog, with the movie being discussed first.
+    """
+    movies = named_movies(movie_catalog, user_message)
+    if not movies:
+        movies = [movie for movie in movie_catalog.values() if movie["id"] != current_movie]
+        if current_movie in movie_catalog:
+            movies.insert(0, movie_catalog[current_movie])
+        return movies
+    if current_movie in movie_catalog and movie_catalog[current_movie] not in movies:
+        movies.append(movie_catalog[current_movie])
+    return movies
+
 
 if __name__ == "__main__":
     cl.main()
@@ -0,0 +1,11 @@
+"""
+The token-budgeted history window, shared by the apps; see shared/history.py.
+"""
+
+import os
+import sys
+
+# The apps are run from their own folders, so the repository root isn't on the path by default
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from shared.history import DEFAULT_TOKEN_BUDGET, build_prompt, count_message_tokens, count_text_tokens  # noqa: E402
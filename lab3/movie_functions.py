@@ -1,41 +1,170 @@
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
 import requests
 from serpapi import GoogleSearch
-import os
 
-def get_now_playing_movies():
-    url = "https://api.themoviedb.org/3/movie/now_playing?language=en-US&page=1"
-    headers = {
+from history import count_text_tokens
+from response_cache import cache
+
+# How long upstream responses are reused, in seconds
+NOW_PLAYING_TTL = 3600
+REVIEWS_TTL = 3600
+SHOWTIMES_TTL = 1800
+
+# Upstream requests give up after this long, so a stalled API can't hold a tool call forever
+REQUEST_TIMEOUT = 10
+CONNECT_TIMEOUT = 5
+
+TMDB_BASE_URL = "https://api.themoviedb.org/3"
+
+# Pages of now playing movies fetched at once (20 movies per page) for the session catalog
+NOW_PLAYING_PAGES = 3
+# Movies listed in the tool result; the rest stay in the catalog, so the history only grows by one page
+NOW_PLAYING_SHOWN = 20
+# Overviews are cut to this many characters in the movie list
+OVERVIEW_CHARS = 200
+# Reviews are trimmed to fit this many tokens before they enter the chat history
+REVIEW_TOKEN_BUDGET = 1200
+
+# SerpAPI only ships a blocking client; it runs on these threads instead of the event loop
+SEARCH_WORKERS = 4
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="serpapi")
+
+_http_client = None
+
+class MovieAPIError(Exception):
+    pass
+
+def tmdb_headers():
+    return {
+        "accept": "application/json",
         "Authorization": f"Bearer {os.getenv('TMDB_API_ACCESS_TOKEN')}"
     }
-    response = requests.get(url, headers=headers)
+
+def get_http_client():
+    """
+    Shared client for the async tools; keeps connections to TMDb open between calls.
+
+    It lives as long as the app process. Chainlit 1.2 has no app shutdown hook, and idle
+    connections expire after keepalive_expiry anyway.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            base_url=TMDB_BASE_URL,
+            headers=tmdb_headers(),
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30),
+        )
+    return _http_client
+
+async def tmdb_get_async(path, error_prefix):
+    try:
+        response = await get_http_client().get(path)
+    except httpx.TimeoutException:
+        raise MovieAPIError(f"{error_prefix}: request to TMDb timed out")
+    except httpx.HTTPError as e:
+        raise MovieAPIError(f"{error_prefix}: {e}")
 
     if response.status_code != 200:
-        return f"Error fetching data: {response.status_code} - {response.reason}"
+        raise MovieAPIError(f"{error_prefix}: {response.status_code} - {response.reason_phrase}")
+
+    return response.json()
+
+def tmdb_get(path, error_prefix):
+    try:
+        response = requests.get(TMDB_BASE_URL + path, headers=tmdb_headers(),
+                                timeout=(CONNECT_TIMEOUT, REQUEST_TIMEOUT))
+    except requests.RequestException as e:
+        raise MovieAPIError(f"{error_prefix}: {e}")
+
+    if response.status_code != 200:
+        raise MovieAPIError(f"{error_prefix}: {response.status_code} - {response.reason}")
+
+    return response.json()
 
-    data = response.json()
+@cache.cached("now_playing", ttl=NOW_PLAYING_TTL)
+def fetch_now_playing(page):
+    return tmdb_get(f"/movie/now_playing?language=en-US&page={page}", "Error fetching data")
 
-    movies = data.get('results', [])
-    if not movies:
+@cache.cached_async("now_playing", ttl=NOW_PLAYING_TTL)
+async def fetch_now_playing_async(page):
+    return await tmdb_get_async(f"/movie/now_playing?language=en-US&page={page}", "Error fetching data")
+
+def movie_records(data):
+    """Compact id -> record catalog of a TMDb movie list."""
+    return {
+        movie['id']: {
+            "id": movie['id'],
+            "title": movie.get('title', 'N/A'),
+            "release_date": movie.get('release_date', 'N/A'),
+            "overview": truncate(movie.get('overview') or 'N/A', OVERVIEW_CHARS),
+        }
+        for movie in data.get('results', [])
+        if 'id' in movie
+    }
+
+async def fetch_now_playing_bulk_async(pages=NOW_PLAYING_PAGES):
+    """Fetches the first pages of now playing movies concurrently, merged into one catalog."""
+    responses = await asyncio.gather(
+        *(fetch_now_playing_async(page) for page in range(1, pages + 1)), return_exceptions=True
+    )
+    # Later pages are a bonus; only a failure of the first page is reported
+    if isinstance(responses[0], BaseException):
+        raise responses[0]
+
+    catalog = {}
+    for response in responses:
+        if not isinstance(response, BaseException):
+            for movie_id, record in movie_records(response).items():
+                catalog.setdefault(movie_id, record)
+    return catalog
+
+def truncate(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "…"
+
+def format_now_playing(catalog, limit=NOW_PLAYING_SHOWN):
+    if not catalog:
         return "No movies are currently playing."
 
-    formatted_movies = "The TMDb API returned these movies:\n\n"
-
-    for movie in movies:
-        title = movie.get('title', 'N/A')
-        movie_id = movie.get('id', 'N/A')
-        release_date = movie.get('release_date', 'N/A')
-        overview = movie.get('overview', 'N/A')
-        formatted_movies += (
-            f"**Title:** {title}\n"
-            f"**Movie ID:** {movie_id}\n"
-            f"**Release Date:** {release_date}\n"
-            f"**Overview:** {overview}\n\n"
-        )
+    movies = list(catalog.values())
+    lines = ["The TMDb API returned these movies (id | title | release date | overview):"]
+    lines.extend(
+        f"{movie['id']} | {movie['title']} | {movie['release_date']} | {movie['overview']}"
+        for movie in movies[:limit]
+    )
+    if len(movies) > limit:
+        lines.append(f"...and {len(movies) - limit} more now playing, not listed.")
+    return "\n".join(lines)
 
-    return formatted_movies
+async def get_now_playing_catalog_async():
+    try:
+        return await fetch_now_playing_bulk_async()
+    except MovieAPIError:
+        return {}
 
-def get_showtimes(title, location):
+def get_now_playing_movies():
+    try:
+        data = fetch_now_playing(1)
+    except MovieAPIError as e:
+        return str(e)
+
+    return format_now_playing(movie_records(data))
+
+async def get_now_playing_movies_async():
+    try:
+        catalog = await fetch_now_playing_bulk_async()
+    except MovieAPIError as e:
+        return str(e)
+
+    return format_now_playing(catalog)
+
+def search_showtimes(title, location):
     params = {
         "api_key": os.getenv('SERP_API_KEY'),
         "engine": "google",
@@ -47,61 +176,128 @@ def get_showtimes(title, location):
     }
 
     search = GoogleSearch(params)
-    results = search.get_dict()
+    # The client's default timeout is 60000 seconds; without a shorter one a hung search holds its worker thread
+    search.timeout = (CONNECT_TIMEOUT, REQUEST_TIMEOUT)
+    try:
+        results = search.get_dict()
+    except requests.RequestException as e:
+        raise MovieAPIError(f"Error fetching showtimes: {e}")
+
+    if 'error' in results:
+        raise MovieAPIError(f"Error fetching showtimes: {results['error']}")
 
-    if 'showtimes' not in results:
+    # Only the showtimes are kept, the rest of the search results are large and unused
+    return {"showtimes": results.get('showtimes', [])}
+
+fetch_showtimes = cache.cached("showtimes", ttl=SHOWTIMES_TTL)(search_showtimes)
+
+@cache.cached_async("showtimes", ttl=SHOWTIMES_TTL)
+async def fetch_showtimes_async(title, location):
+    loop = asyncio.get_running_loop()
+    try:
+        # The search itself times out on its thread, this bounds the total wait including time queued for a worker
+        return await asyncio.wait_for(
+            loop.run_in_executor(search_executor, search_showtimes, title, location), CONNECT_TIMEOUT + REQUEST_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise MovieAPIError("Error fetching showtimes: search timed out")
+
+def format_showtimes(results, title, location):
+    if not results['showtimes']:
         return f"No showtimes found for {title} in {location}."
 
     showtimes = results['showtimes'][0]
-    formatted_showtimes = f"Showtimes for {title} in {location}:\n\n"
+    lines = [f"Showtimes for {title} in {location}:", ""]
 
     if showtimes['theaters']:
         theater = showtimes['theaters'][0]
-        theater_name = theater.get('name', 'Unknown Theater')
-        formatted_showtimes += f"**{theater_name}**\n"
+        lines.append(f"**{theater.get('name', 'Unknown Theater')}**")
+        lines.append(f"  {showtimes.get('day', 'Unknown Date')}:")
+        lines.extend(
+            f"    - {time}"
+            for showing in theater.get('showing', [])
+            for time in showing.get('time', [])
+        )
+
+    return "\n".join(lines) + "\n"
 
-        date = showtimes.get('day', 'Unknown Date')
-        formatted_showtimes += f"  {date}:\n"
+def get_showtimes(title, location):
+    try:
+        results = fetch_showtimes(title, location)
+    except MovieAPIError as e:
+        return str(e)
 
-        for showing in theater.get('showing', []):
-            for time in showing.get('time', []):
-                formatted_showtimes += f"    - {time}\n"
+    return format_showtimes(results, title, location)
 
-    formatted_showtimes += "\n"
+async def get_showtimes_async(title, location):
+    try:
+        results = await fetch_showtimes_async(title, location)
+    except MovieAPIError as e:
+        return str(e)
 
-    return formatted_showtimes
+    return format_showtimes(results, title, location)
 
 def buy_ticket(theater, movie, showtime):
     return f"Ticket purchased for {movie} at {theater} for {showtime}."
 
-def get_reviews(movie_id):
-    url = f"https://api.themoviedb.org/3/movie/{movie_id}/reviews?language=en-US&page=1"
-    print("review url: ", url)
-    headers = {
-        "accept": "application/json",
-        "Authorization": f"Bearer {os.getenv('TMDB_API_ACCESS_TOKEN')}"
-    }
-    response = requests.get(url, headers=headers)
-    reviews_data = response.json()
+async def buy_ticket_async(theater, movie, showtime):
+    return buy_ticket(theater, movie, showtime)
+
+@cache.cached("reviews", ttl=REVIEWS_TTL)
+def fetch_reviews(movie_id):
+    return tmdb_get(f"/movie/{movie_id}/reviews?language=en-US&page=1", "Error fetching reviews")
+
+@cache.cached_async("reviews", ttl=REVIEWS_TTL)
+async def fetch_reviews_async(movie_id):
+    return await tmdb_get_async(f"/movie/{movie_id}/reviews?language=en-US&page=1", "Error fetching reviews")
+
+def truncate_to_tokens(text, max_tokens):
+    tokens = count_text_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # Cut proportionally; close enough for a budget, and avoids re-tokenizing every prefix
+    return truncate(text, len(text) * max_tokens // tokens)
 
-    if 'results' not in reviews_data or not reviews_data['results']:
+def format_reviews(reviews_data, token_budget=REVIEW_TOKEN_BUDGET):
+    reviews = reviews_data.get('results') or []
+    if not reviews:
         return "No reviews found."
 
-    formatted_reviews = ""
-    for review in reviews_data['results']:
-        author = review.get('author', 'N/A')
-        rating = review.get('author_details', {}).get('rating', 'N/A')
-        content = review.get('content', 'N/A')
-        created_at = review.get('created_at', 'N/A')
-        url = review.get('url', 'N/A')
-
-        formatted_reviews += (
-            f"**Author:** {author}\n"
-            f"**Rating:** {rating}\n"
-            f"**Content:** {content}\n"
-            f"**Created At:** {created_at}\n"
-            f"**URL:** {url}\n"
-            "----------------------------------------\n"
-        )
+    lines = []
+    remaining = token_budget
+    # Each review gets an equal share of the budget, so one long review can't crowd out the rest
+    per_review = max(token_budget // len(reviews), 50)
+    for review in reviews:
+        if remaining <= 0:
+            break
+        rating = review.get('author_details', {}).get('rating')
+        header = f"- {review.get('author', 'N/A')}" + (f" ({rating}/10)" if rating is not None else "") + ": "
+        content = " ".join((review.get('content') or 'N/A').split())
+        line = header + truncate_to_tokens(content, min(per_review, remaining))
+        remaining -= count_text_tokens(line)
+        lines.append(line)
+
+    omitted = len(reviews) - len(lines)
+    if omitted:
+        lines.append(f"({omitted} more reviews omitted)")
+    return "\n".join(lines)
+
+def get_reviews(movie_id):
+    try:
+        # The model may pass the id as a number or a string, so normalize it for the cache key
+        reviews_data = fetch_reviews(str(movie_id))
+    except MovieAPIError as e:
+        return str(e)
+
+    return format_reviews(reviews_data)
+
+async def get_reviews_async(movie_id):
+    try:
+        reviews_data = await fetch_reviews_async(str(movie_id))
+    except MovieAPIError as e:
+        return str(e)
+
+    return format_reviews(reviews_data)
 
-    return formatted_reviews
+def get_cache_stats():
+    return cache.stats()
@@ -0,0 +1,200 @@
+"""
+TTL cache for the upstream API calls made by the movie tools.
+
+Entries expire after a per-function TTL and the least recently used entries are evicted
+once the cache is full. By default entries live in process memory; set MOVIE_CACHE_DB
+to a file path to keep them in SQLite instead, so several workers share their hits.
+
+Concurrent calls for the same key are collapsed: the first caller fetches, and the
+others wait for its result instead of making their own upstream request.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+DEFAULT_MAX_ENTRIES = 1024
+
+
+class MemoryBackend:
+    blocking = False
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteBackend:
+    """Shared cache in a SQLite file; values must be JSON-serializable."""
+
+    # Reads and writes hit the disk, so async callers run them on a worker thread
+    blocking = True
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM response_cache WHERE key = ? AND expires_at >= ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now),
+            )
+            self._conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                " SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self._in_flight = {}
+        self._async_in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _count(self, name, counter):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"hits": 0, "misses": 0, "coalesced": 0})
+            stats[counter] += 1
+
+    def stats(self):
+        """Hit, miss and coalesced-request counts per cached function."""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def cached(self, name, ttl):
+        """Decorator caching the function's result for ttl seconds, keyed by its arguments."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                key = f"{name}:{json.dumps(args)}"
+                value = self.backend.get(key)
+                if value is not None:
+                    self._count(name, "hits")
+                    return value
+
+                with self._lock:
+                    future = self._in_flight.get(key)
+                    is_owner = future is None
+                    if is_owner:
+                        future = self._in_flight[key] = Future()
+                if not is_owner:
+                    self._count(name, "coalesced")
+                    return future.result()
+
+                self._count(name, "misses")
+                try:
+                    value = func(*args)
+                    # Failed requests raise, so errors are never cached
+                    self.backend.set(key, value, ttl)
+                    future.set_result(value)
+                    return value
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                finally:
+                    with self._lock:
+                        del self._in_flight[key]
+            return wrapper
+        return decorator
+
+    async def _backend_call(self, method, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    def cached_async(self, name, ttl):
+        """Like cached(), for coroutine functions; duplicate calls await the same task."""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args):
+                key = f"{name}:{json.dumps(args)}"
+                value = await self._backend_call(self.backend.get, key)
+                if value is not None:
+                    self._count(name, "hits")
+                    return value
+
+                task = self._async_in_flight.get(key)
+                if task is not None:
+                    self._count(name, "coalesced")
+                    # Shielded, so one waiter being cancelled doesn't cancel the fetch for the others
+                    return await asyncio.shield(task)
+
+                self._count(name, "misses")
+
+                async def fetch():
+                    try:
+                        value = await func(*args)
+                        await self._backend_call(self.backend.set, key, value, ttl)
+                        return value
+                    finally:
+                        self._async_in_flight.pop(key, None)
+
+                task = self._async_in_flight[key] = asyncio.ensure_future(fetch())
+                return await asyncio.shield(task)
+            return wrapper
+        return decorator
+
+
+def _default_backend():
+    path = os.getenv("MOVIE_CACHE_DB")
+    if path:
+        return SQLiteBackend(path)
+    return MemoryBackend()
+
+
+cache = ResponseCache(_default_backend())
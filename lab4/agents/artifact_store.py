@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+
+
+class ArtifactEditError(Exception):
+    pass
+
+
+def apply_edits(contents, edits):
+    """
+    Applies search/replace edits in order and returns the new contents.
+
+    Every search string must match exactly once in the contents as left by the previous
+    edits. If any edit doesn't, ArtifactEditError is raised and none of them are applied.
+    """
+    # The edits come straight from the model's tool call, so their shape is checked before any is applied
+    if not isinstance(edits, list) or not edits:
+        raise ArtifactEditError("edits must be a non-empty list of {search, replace} objects")
+    for number, edit in enumerate(edits, start=1):
+        if not isinstance(edit, dict):
+            raise ArtifactEditError(f"edit {number} must be an object with search and replace strings")
+        if not isinstance(edit.get("search"), str) or not isinstance(edit.get("replace", ""), str):
+            raise ArtifactEditError(f"edit {number}: search and replace must be strings")
+
+    for number, edit in enumerate(edits, start=1):
+        search = edit["search"]
+        replace = edit.get("replace", "")
+        if not search:
+            raise ArtifactEditError(f"edit {number} has an empty search string")
+        count = contents.count(search)
+        if count == 0:
+            raise ArtifactEditError(f"edit {number}: search text not found")
+        if count > 1:
+            raise ArtifactEditError(f"edit {number}: search text matches {count} places, include more context")
+        contents = contents.replace(search, replace, 1)
+    return contents
+
+
+class ArtifactStore:
+    """
+    In-memory copy of the artifacts directory, shared by the agents.
+
+    Writes made through the store update the cache directly. Files edited outside the
+    store are picked up by comparing their mtime and size, and the directory is only
+    listed again when its own mtime changes (a file was added or removed). Each file's
+    <FILE> block is rendered once, with a short content hash, so building the prompt
+    only re-joins the blocks.
+
+    Files are written to a temporary file and renamed into place, so a crash never leaves
+    a half-written artifact. The a-prefixed methods run the file I/O on a worker thread,
+    keeping it off the event loop.
+    """
+
+    def __init__(self, directory="artifacts"):
+        self.directory = directory
+        # filename -> {"stat": (mtime_ns, size), "contents": str, "block": str}
+        self._files = {}
+        self._directory_mtime = None
+        self._rendered = None
+        # Bumped on every change, so a caller holding a rendered block can tell whether it's still current
+        self.version = 0
+        # Reentrant, since edit() reads and writes under the same lock
+        self._lock = threading.RLock()
+
+    def _path(self, filename):
+        # Artifacts are flat files in the store's directory; this keeps a session's files inside it
+        if not filename or os.path.basename(filename) != filename or filename.startswith("."):
+            raise ArtifactEditError(f"invalid artifact name '{filename}'")
+        return os.path.join(self.directory, filename)
+
+    def _load(self, filename, stat):
+        with open(self._path(filename), "r") as file:
+            contents = file.read()
+        self._cache(filename, contents, stat)
+
+    def _cache(self, filename, contents, stat):
+        self._files[filename] = {
+            "stat": (stat.st_mtime_ns, stat.st_size),
+            "contents": contents,
+            # The hash lets the model (and a reader of the logs) tell at a glance which files changed
+            "block": f"<FILE name='{filename}' sha256='{hashlib.sha256(contents.encode()).hexdigest()[:12]}'>\n"
+                     f"{contents}\n</FILE>\n",
+        }
+        self._changed()
+
+    def _changed(self):
+        self._rendered = None
+        self.version += 1
+
+    def refresh(self):
+        """Picks up files added, removed or edited on disk since the last call."""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        try:
+            directory_mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            if self._files:
+                self._files = {}
+                self._changed()
+            self._directory_mtime = None
+            return
+
+        if directory_mtime != self._directory_mtime:
+            self._directory_mtime = directory_mtime
+            # Dotfiles are skipped, which includes the temporary files of writes in progress
+            filenames = {
+                filename for filename in os.listdir(self.directory)
+                if not filename.startswith(".") and os.path.isfile(self._path(filename))
+            }
+            for filename in list(self._files):
+                if filename not in filenames:
+                    del self._files[filename]
+                    self._changed()
+            for filename in filenames - self._files.keys():
+                self._load(filename, os.stat(self._path(filename)))
+
+        for filename, cached in list(self._files.items()):
+            try:
+                stat = os.stat(self._path(filename))
+            except FileNotFoundError:
+                del self._files[filename]
+                self._changed()
+                continue
+            if (stat.st_mtime_ns, stat.st_size) != cached["stat"]:
+                self._load(filename, stat)
+
+    def read(self, filename):
+        with self._lock:
+            self._refresh()
+            cached = self._files.get(filename)
+            return cached["contents"] if cached else None
+
+    def write(self, filename, contents):
+        path = self._path(filename)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{filename}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as file:
+                    file.write(contents)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            self._cache(filename, contents, os.stat(path))
+            # The rename changed the directory's mtime, so list it again on the next refresh
+            self._directory_mtime = None
+
+    def edit(self, filename, edits):
+        """Applies search/replace edits to an existing artifact, all or nothing."""
+        with self._lock:
+            contents = self.read(filename)
+            if contents is None:
+                raise ArtifactEditError(f"'{filename}' doesn't exist, create it with updateArtifact")
+            if not edits:
+                raise ArtifactEditError("no edits given")
+            self.write(filename, apply_edits(contents, edits))
+
+    def render(self):
+        """The <ARTIFACTS> block for the system prompt."""
+        return self.render_versioned()[1]
+
+    def render_versioned(self):
+        """The <ARTIFACTS> block, with the version it was rendered at."""
+        with self._lock:
+            self._refresh()
+            if self._rendered is None:
+                # Sorted, so unchanged artifacts always render the same and keep the request stable
+                blocks = "".join(self._files[filename]["block"] for filename in sorted(self._files))
+                self._rendered = f"<ARTIFACTS>\n{blocks}</ARTIFACTS>"
+            return self.version, self._rendered
+
+    async def aread(self, filename):
+        return await asyncio.to_thread(self.read, filename)
+
+    async def awrite(self, filename, contents):
+        await asyncio.to_thread(self.write, filename, contents)
+
+    async def aedit(self, filename, edits):
+        await asyncio.to_thread(self.edit, filename, edits)
+
+    async def arender(self):
+        return await asyncio.to_thread(self.render)
+
+    async def arender_versioned(self):
+        return await asyncio.to_thread(self.render_versioned)
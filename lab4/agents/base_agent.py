@@ -1,141 +1,288 @@
-import os
+import json
+import logging
 import chainlit as cl
+from agents.artifact_store import ArtifactEditError, ArtifactStore
+from agents.tool_calls import ToolCallAccumulator
+
+logger = logging.getLogger(__name__)
+
+UPDATE_ARTIFACT_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "updateArtifact",
+        "description": "Update an artifact file which is HTML, CSS, or markdown with the given contents.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "filename": {
+                    "type": "string",
+                    "description": "The name of the file to update.",
+                },
+                "contents": {
+                    "type": "string",
+                    "description": "The markdown, HTML, or CSS contents to write to the file.",
+                },
+            },
+            "required": ["filename", "contents"],
+            "additionalProperties": False,
+        },
+    }
+}
+
+EDIT_ARTIFACT_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "editArtifact",
+        "description": "Change part of an existing artifact file with search/replace edits, instead of rewriting "
+                       "the whole file. Each search string must match exactly one place in the current file; "
+                       "edits are applied in order, and if any of them fails, none are applied.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "filename": {
+                    "type": "string",
+                    "description": "The name of the file to edit.",
+                },
+                "edits": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "search": {
+                                "type": "string",
+                                "description": "Exact text to find, copied from the current file, with enough "
+                                               "surrounding lines to be unique.",
+                            },
+                            "replace": {
+                                "type": "string",
+                                "description": "Text to put in its place.",
+                            },
+                        },
+                        "required": ["search", "replace"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["filename", "edits"],
+            "additionalProperties": False,
+        },
+    }
+}
 
 class Agent:
     """
     Base class for all agents.
     """
 
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "updateArtifact",
-                "description": "Update an artifact file which is HTML, CSS, or markdown with the given contents.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "filename": {
-                            "type": "string",
-                            "description": "The name of the file to update.",
-                        },
-                        "contents": {
-                            "type": "string",
-                            "description": "The markdown, HTML, or CSS contents to write to the file.",
-                        },
-                    },
-                    "required": ["filename", "contents"],
-                    "additionalProperties": False,
-                },
-            }
-        }
-    ]
+    tools = [UPDATE_ARTIFACT_TOOL, EDIT_ARTIFACT_TOOL]
+    # Tools that run only after the stream and the turn's other tool calls have finished
+    terminal_tools = ()
 
-    def __init__(self, name, client, prompt="", gen_kwargs=None):
+    def __init__(self, name, client, prompt="", gen_kwargs=None, artifacts=None):
         self.name = name
         self.client = client
         self.prompt = prompt
+        self.artifacts = artifacts or ArtifactStore()
+        # Tool name -> coroutine taking (arguments, turn); subclasses add their own tools
+        self.tool_handlers = {
+            "updateArtifact": self._update_artifact,
+            "editArtifact": self._edit_artifact,
+        }
         self.gen_kwargs = gen_kwargs or {
             "model": "gpt-4o",
             "temperature": 0.2
         }
 
-    async def execute(self, message_history):
+    async def execute(self, message_history, response_message=None, artifacts_context=None):
         """
         Executes the agent's main functionality.
 
+        When another agent hands off to this one, it passes its response message, so the reply
+        streams into the same message, and the (version, block) of the artifacts it rendered,
+        which is reused if no artifact changed since.
+
         Note: probably shouldn't couple this with chainlit, but this is just a prototype.
         """
-        copied_message_history = message_history.copy()
+        turn = await self.run_turn(message_history, response_message, artifacts_context)
+        return turn["response_message"].content
 
-        # Check if the first message is a system prompt
-        if copied_message_history and copied_message_history[0]["role"] == "system":
-            # Replace the system prompt with the agent's prompt
-            copied_message_history[0] = {"role": "system", "content": self._build_system_prompt()}
-        else:
-            # Insert the agent's prompt at the beginning
-            copied_message_history.insert(0, {"role": "system", "content": self._build_system_prompt()})
+    async def run_turn(self, message_history, response_message=None, artifacts_context=None):
+        """
+        Same as execute(), but returns the turn, which records the artifacts that were
+        written ("written") and the tool calls that failed ("failed").
+        """
+        if artifacts_context is None or artifacts_context[0] != self.artifacts.version:
+            artifacts_context = await self.artifacts.arender_versioned()
+        copied_message_history = self._build_messages(message_history, artifacts_context[1])
 
-        response_message = cl.Message(content="")
-        await response_message.send()
+        owns_message = response_message is None
+        if owns_message:
+            response_message = cl.Message(content="")
+            await response_message.send()
+        elif response_message.content:
+            await response_message.stream_token("\n\n")
 
-        stream = await self.client.chat.completions.create(messages=copied_message_history, stream=True, tools=self.tools, tool_choice="auto", **self.gen_kwargs)
+        stream = await self.client.chat.completions.create(messages=copied_message_history, stream=True, tools=self.tools, tool_choice="auto", stream_options={"include_usage": True}, **self.gen_kwargs)
 
-        function_calls = []
-        function_name = ""
-        arguments = ""
+        turn = {
+            "message_history": message_history,
+            "response_message": response_message,
+            "artifacts_context": artifacts_context,
+            "written": [],
+            "failed": [],
+        }
+        tool_calls = ToolCallAccumulator(lambda tool_call: self._call_tool(tool_call, turn), key=self._tool_call_file,
+                                         terminal=self.terminal_tools)
         async for part in stream:
+            if not part.choices:
+                # The last chunk only carries the usage
+                self._record_usage(part.usage)
+                continue
             if part.choices[0].delta.tool_calls:
-                tool_call = part.choices[0].delta.tool_calls[0]
-                function_name_delta = tool_call.function.name or ""
-                arguments_delta = tool_call.function.arguments or ""
-
-                if function_name_delta != "" and function_name != "":
-                    function_calls.append([function_name, arguments])
-                    function_name = function_name_delta
-                    arguments = ""
-                else:
-                    function_name += function_name_delta
-                    arguments += arguments_delta
+                tool_calls.add(part.choices[0].delta.tool_calls)
 
             if token := part.choices[0].delta.content or "":
                 await response_message.stream_token(token)
-        function_calls.append([function_name, arguments])
 
-        for function_name, arguments in function_calls:
-            if function_name:
-                print("DEBUG: function_name:")
-                print("type:", type(function_name))
-                print("value:", function_name)
-                print("DEBUG: arguments:")
-                print("type:", type(arguments))
-                print("value:", arguments)
+        results = await tool_calls.finish()
+        if not results:
+            print("No tool call")
 
-                if function_name == "updateArtifact":
-                    import json
+        notes = [result for _, result in results if result]
+        if notes:
+            # Add a message to the message history
+            for note in notes:
+                message_history.append({
+                    "role": "system",
+                    "content": note
+                })
 
-                    arguments_dict = json.loads(arguments)
-                    filename = arguments_dict.get("filename")
-                    contents = arguments_dict.get("contents")
+            # One reply covers every tool call of the turn. A terminal tool has already answered in
+            # the response message, so a follow-up would only repeat the notes after its output.
+            if not any(call["function"]["name"] in self.terminal_tools for call, _ in results):
+                await self._stream_follow_up(message_history, response_message)
 
-                    if filename and contents:
-                        os.makedirs("artifacts", exist_ok=True)
-                        with open(os.path.join("artifacts", filename), "w") as file:
-                            file.write(contents)
+        if owns_message:
+            await response_message.update()
 
-                        # Add a message to the message history
-                        message_history.append({
-                            "role": "system",
-                            "content": f"The artifact '{filename}' was updated."
-                        })
+        return turn
 
-                        stream = await self.client.chat.completions.create(messages=message_history, stream=True, **self.gen_kwargs)
-                        async for part in stream:
-                            if token := part.choices[0].delta.content or "":
-                                await response_message.stream_token(token)
+    async def _call_tool(self, tool_call, turn):
+        """
+        Runs one tool call through its handler. Returns a status message for the history, or None.
 
-            else:
-                print("No tool call")
+        Handlers take the parsed arguments and the turn: the message history, the response message
+        and the artifacts context of the call, and the lists of written files and failures to add to.
+        """
+        function_name = tool_call["function"]["name"]
+        arguments = tool_call["function"]["arguments"]
+        logger.debug("Tool call: %s %s", function_name, arguments)
 
-        await response_message.update()
+        handler = self.tool_handlers.get(function_name)
+        if handler is None:
+            turn["failed"].append(f"Unknown tool: {function_name}")
+            return turn["failed"][-1]
+        try:
+            arguments_dict = json.loads(arguments or "{}")
+        except json.JSONDecodeError:
+            turn["failed"].append(f"The arguments for {function_name} were not valid JSON, the tool was not run.")
+            return turn["failed"][-1]
+        if not isinstance(arguments_dict, dict):
+            turn["failed"].append(f"The arguments for {function_name} were not a JSON object, the tool was not run.")
+            return turn["failed"][-1]
 
-        return response_message.content
+        return await handler(arguments_dict, turn)
 
-    def _build_system_prompt(self):
+    @staticmethod
+    def _tool_call_file(tool_call):
         """
-        Builds the system prompt including the agent's prompt and the contents of the artifacts folder.
+        The artifact a tool call writes, if any. Calls on the same file run in the order they were made.
         """
-        artifacts_content = "<ARTIFACTS>\n"
-        artifacts_dir = "artifacts"
+        try:
+            arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+        except json.JSONDecodeError:
+            return None
+        filename = arguments.get("filename") if isinstance(arguments, dict) else None
+        return filename if isinstance(filename, str) else None
+
+    async def _update_artifact(self, arguments, turn):
+        filename = arguments.get("filename")
+        contents = arguments.get("contents")
+        if not filename or not contents:
+            turn["failed"].append("updateArtifact was called without a filename or contents.")
+            return None
+
+        try:
+            await self.artifacts.awrite(filename, contents)
+        except ArtifactEditError as e:
+            turn["failed"].append(f"The artifact '{filename}' was not written: {e}.")
+            return turn["failed"][-1]
+        turn["written"].append(filename)
+        return f"The artifact '{filename}' was updated."
+
+    async def _edit_artifact(self, arguments, turn):
+        filename = arguments.get("filename")
+        if not filename:
+            turn["failed"].append("editArtifact was called without a filename.")
+            return None
 
-        if os.path.exists(artifacts_dir) and os.path.isdir(artifacts_dir):
-            for filename in os.listdir(artifacts_dir):
-                file_path = os.path.join(artifacts_dir, filename)
-                if os.path.isfile(file_path):
-                    with open(file_path, "r") as file:
-                        file_content = file.read()
-                        artifacts_content += f"<FILE name='{filename}'>\n{file_content}\n</FILE>\n"
+        try:
+            await self.artifacts.aedit(filename, arguments.get("edits") or [])
+        except ArtifactEditError as e:
+            # Nothing was written, so the model can retry against the unchanged file
+            turn["failed"].append(f"The edits to '{filename}' were not applied: {e}. The file is unchanged.")
+            return turn["failed"][-1]
+        turn["written"].append(filename)
+        return f"The artifact '{filename}' was updated."
 
-        artifacts_content += "</ARTIFACTS>"
+    async def _stream_follow_up(self, message_history, response_message):
+        """
+        Streams the reply to a tool result into the response message.
+        """
+        # Same tools and layout as the first call, so the request shares its cached prefix
+        messages = self._build_messages(message_history, await self.artifacts.arender())
+        stream = await self.client.chat.completions.create(messages=messages, stream=True, tools=self.tools, tool_choice="none", stream_options={"include_usage": True}, **self.gen_kwargs)
+        async for part in stream:
+            if not part.choices:
+                self._record_usage(part.usage)
+                continue
+            if token := part.choices[0].delta.content or "":
+                await response_message.stream_token(token)
+
+    def _record_usage(self, usage):
+        """
+        Logs how much of the prompt was served from the provider's prompt cache.
+        """
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        # Older clients keep fields they don't know about as plain dicts
+        if isinstance(details, dict):
+            cached_tokens = details.get("cached_tokens") or 0
+        else:
+            cached_tokens = getattr(details, "cached_tokens", 0) or 0
+
+        metrics = {
+            "agent": self.name,
+            "prompt_tokens": usage.prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "cache_hit_rate": round(cached_tokens / usage.prompt_tokens, 3) if usage.prompt_tokens else 0,
+            "completion_tokens": usage.completion_tokens,
+        }
+        print("Prompt cache metrics:", metrics)
+        cl.user_session.set("prompt_cache_metrics", metrics)
+
+    def _build_messages(self, message_history, artifacts_block):
+        """
+        Builds the request messages, ordered from most to least stable so providers can reuse the cached prefix:
+        the agent's prompt, then the conversation, then the artifacts, which change on most turns.
+        """
+        if message_history and message_history[0]["role"] == "system":
+            # The agent's prompt takes the place of the app's system prompt
+            message_history = message_history[1:]
 
-        return f"{self.prompt}\n{artifacts_content}"
+        return [
+            {"role": "system", "content": self.prompt},
+            *message_history,
+            {"role": "system", "content": artifacts_block},
+        ]
@@ -1,24 +1,129 @@
 from agents.base_agent import Agent
+from agents.milestones import check_off, describe, next_wave, parse_milestones
+import chainlit as cl
 
 IMPLEMENTATION_PROMPT = """\
 You are a software developer, and are tasked with implementing a web page based on the plan \
 described below.
 
-The plan is stored in an artifact called `plan.md`. You will only complete one milestone at a time. \
-You should output the required code implement the milestone.
+The plan is stored in an artifact called `plan.md`. Unless you are told which milestones to implement, \
+complete only the next unchecked milestone. You should output the required code to implement the milestones.
 
-First, implement the HTML for the milestone. Call the function updateArtifact with the filename `index.html` \
-and the contents of the HTML file.
+First, implement the HTML for the milestones in `index.html`.
 
-Second, implement the CSS for the milestone. Call the function updateArtifact with the filename `styles.css` \
-and the contents of the CSS file.
+Second, implement the CSS for the milestones in `styles.css`.
 
-Finally, update the plan.md file to check off the completed milestone.
+Finally, update the plan.md file to check off each milestone you completed.
+
+To create a file, or when most of it changes, call the function updateArtifact with the filename and the \
+full contents. To change part of a file that already exists, call the function editArtifact with search/replace \
+edits instead, so only the changed lines are written. Copy each search string exactly from the current file, \
+with enough surrounding lines to match only one place. For example, check off a milestone in plan.md by \
+replacing `- [ ] 2.` with `- [x] 2.`.
 """
 
+# How many calls a wave of milestones gets before the build stops
+WAVE_ATTEMPTS = 2
+
 class ImplementationAgent(Agent):
-    def __init__(self, name, client, prompt=IMPLEMENTATION_PROMPT):
-        super().__init__(name, client, prompt)
+    def __init__(self, name, client, prompt=IMPLEMENTATION_PROMPT, artifacts=None):
+        super().__init__(name, client, prompt, artifacts=artifacts)
+
+    def execute(self, message_history, response_message=None, artifacts_context=None):
+        return super().execute(message_history, response_message, artifacts_context)
+
+    async def execute_plan(self, message_history, response_message=None, artifacts_context=None):
+        """
+        Builds every remaining milestone of plan.md without waiting for the user in between.
+
+        Milestones whose dependencies are all done form a wave, and each wave is implemented
+        in one call. They all edit the same index.html and styles.css, so a wave is batched
+        into one call rather than split across concurrent calls that would overwrite each other.
+
+        A milestone only counts as built once the model checked it off and none of the wave's
+        artifact writes failed. A wave that isn't finished after WAVE_ATTEMPTS calls stops the
+        build, since the milestones after it would build on missing code.
+        """
+        owns_message = response_message is None
+        if owns_message:
+            response_message = cl.Message(content="")
+            await response_message.send()
+
+        built = []
+        unfinished = []
+        plan = await self.artifacts.aread("plan.md")
+        # Every wave either builds at least one milestone or stops the build, so this bounds the loop
+        for _ in range(len(parse_milestones(plan or ""))):
+            wave = next_wave(parse_milestones(plan))
+            if not wave:
+                break
+
+            pending = [milestone["number"] for milestone in wave]
+            separator = "\n\n" if response_message.content else ""
+            await response_message.stream_token(f"{separator}**Building milestone{'s' if len(wave) > 1 else ''} "
+                                                f"{', '.join(map(str, pending))}...**")
+
+            milestone_list = "\n".join(describe(milestone) for milestone in wave)
+            problems = []
+            wave_history = [*message_history, {
+                "role": "system",
+                "content": f"Implement these milestones together in this turn, then check off each of them in plan.md:\n"
+                           f"{milestone_list}"
+            }]
+            for attempt in range(WAVE_ATTEMPTS):
+                if attempt:
+                    await response_message.stream_token(f"\n\n**Retrying milestone{'s' if len(pending) > 1 else ''} "
+                                                        f"{', '.join(map(str, pending))}...**")
+                    # The failed tool results are already in wave_history, so the model can see what to fix
+                    wave_history.append({
+                        "role": "system",
+                        "content": f"Milestones {', '.join(map(str, pending))} are not done yet. Finish them, redoing "
+                                   f"any edits that failed, then check them off in plan.md."
+                    })
+
+                turn = await self.run_turn(wave_history, response_message, artifacts_context)
+                # Only the first call can reuse the caller's render, every call after it may change the artifacts
+                artifacts_context = None
+
+                plan = await self.artifacts.aread("plan.md") or ""
+                checked = [milestone["number"] for milestone in parse_milestones(plan)
+                           if milestone["done"] and milestone["number"] in pending]
+                problems.extend(turn["failed"])
+                if turn["failed"] and checked:
+                    # Some of the wave's code wasn't written, so its check marks can't be trusted
+                    plan = check_off(plan, checked, done=False)
+                    await self.artifacts.awrite("plan.md", plan)
+                    checked = []
+
+                built.extend(milestone for milestone in wave if milestone["number"] in checked)
+                pending = [number for number in pending if number not in checked]
+                if not pending:
+                    break
+
+            if pending:
+                unfinished = [milestone for milestone in wave if milestone["number"] in pending]
+                break
+
+        summary = []
+        if plan is None:
+            summary.append("There is no plan.md to build from yet.")
+        if built:
+            summary.append(f"Built milestones {'; '.join(map(describe, built))}.")
+        if unfinished:
+            reason = " ".join(dict.fromkeys(problems)) or "The milestones were not checked off in plan.md."
+            summary.append(f"Could not build milestones {'; '.join(map(describe, unfinished))}. {reason}")
+            unfinished_numbers = {milestone["number"] for milestone in unfinished}
+            remaining = [milestone["number"] for milestone in parse_milestones(plan)
+                         if not milestone["done"] and milestone["number"] not in unfinished_numbers]
+            if remaining:
+                summary.append(f"Stopped before milestones {', '.join(map(str, remaining))}.")
+        elif plan is not None:
+            summary.append("The page is complete." if built else "All milestones are already complete.")
+        summary = " ".join(summary)
+
+        await response_message.stream_token(f"\n\n{summary}")
+        if owns_message:
+            await response_message.update()
 
-    def execute(self, message_history):
-        return super().execute(message_history)
+        message_history.append({"role": "system", "content": summary})
+        return summary
@@ -0,0 +1,60 @@
+import re
+
+# - [ ] 3. Style the header (after: 1)
+MILESTONE_PATTERN = re.compile(r"^\s*- \[(?P<done>[ xX])\]\s*(?P<number>\d+)\.\s*(?P<text>.*)$", re.MULTILINE)
+AFTER_PATTERN = re.compile(r"\(after:\s*(?P<after>[^)]*)\)", re.IGNORECASE)
+
+
+def parse_milestones(plan):
+    """
+    Parses the milestone checklist of plan.md.
+
+    A milestone can name the milestones it builds on with an `(after: 1, 2)` annotation,
+    or `(after: none)` if it builds on nothing. Without one, it depends on the milestone
+    before it, so an unannotated plan runs in order.
+    """
+    milestones = []
+    previous = None
+    for match in MILESTONE_PATTERN.finditer(plan):
+        number = int(match["number"])
+        text = match["text"].strip()
+        annotation = AFTER_PATTERN.search(text)
+        if annotation:
+            after = [int(n) for n in re.findall(r"\d+", annotation["after"])]
+        else:
+            after = [previous] if previous is not None else []
+        milestones.append({
+            "number": number,
+            "text": text,
+            "done": match["done"] != " ",
+            # Annotations pointing at themselves or later milestones would never be satisfied
+            "after": [n for n in after if n < number],
+        })
+        previous = number
+    return milestones
+
+
+def next_wave(milestones):
+    """The milestones that aren't done yet and whose dependencies all are."""
+    done = {milestone["number"] for milestone in milestones if milestone["done"]}
+    known = {milestone["number"] for milestone in milestones}
+    return [
+        milestone for milestone in milestones
+        if not milestone["done"] and all(n in done or n not in known for n in milestone["after"])
+    ]
+
+
+def describe(milestone):
+    """The milestone's number and text, without its dependency annotation."""
+    return f"{milestone['number']}. {AFTER_PATTERN.sub('', milestone['text']).strip()}"
+
+
+def check_off(plan, numbers, done=True):
+    """Marks the given milestones as done in the plan text, or as not done with done=False."""
+    def replace(match):
+        if int(match["number"]) in numbers:
+            return match[0][:match.start("done") - match.start()] + ("x" if done else " ") + \
+                match[0][match.end("done") - match.start():]
+        return match[0]
+
+    return MILESTONE_PATTERN.sub(replace, plan)
@@ -1,6 +1,4 @@
-from agents.base_agent import Agent
-import os
-import chainlit as cl
+from agents.base_agent import Agent, EDIT_ARTIFACT_TOOL, UPDATE_ARTIFACT_TOOL
 
 PLANNING_PROMPT = """\
 You are a software architect, preparing to build the web page in the image that the user sends.
@@ -12,7 +10,8 @@ the tool again. A tool is available to update the artifact. Your role is only to
 project. You will not implement the plan, and will not write any code.
 
 If the plan has already been saved, no need to save it again unless there is feedback. Do not \
-use the tool again if there are no changes.
+use the tool again if there are no changes. To revise a saved plan, use the editArtifact tool to \
+replace only the sections that changed, rather than saving the whole plan again.
 
 For the contents of the markdown-formatted plan, create two sections, "Overview" and "Milestones".
 
@@ -31,50 +30,41 @@ Milestones should be formatted like this:
 
  - [ ] 1. This is the first milestone
  - [ ] 2. This is the second milestone
- - [ ] 3. This is the third milestone
+ - [ ] 3. This is the third milestone (after: 1)
+
+Each milestone builds on the one before it. If a milestone only depends on some earlier milestones, \
+for example separate sections that can be built in any order, list them at the end like \
+`(after: 1)` above, so independent milestones can be built together.
 
  If the user or reviewer asks to implement the plan, you should use the implementation agent. The implementation agent can \
- use the plan to write the code. It can only complete one milestone at a time. If there are no milestones left, \
+ use the plan to write the code. Unless asked for all milestones, it completes one milestone at a time. If there are no milestones left, \
  it should inform the user that the page is complete. You should output the next milestone to be completed and confirm whether the \
- user wants to proceed. If so, then call the implementation_agent.
+ user wants to proceed. If so, then call the implementation_agent. If the user asks to build the whole page \
+ at once, call the implementation agent with `all_milestones` set to true.
 """
 
 class PlanningAgent(Agent):
-    def __init__(self, name, client, implementation_agent, prompt=PLANNING_PROMPT):
-        super().__init__(name, client, prompt)
+    def __init__(self, name, client, implementation_agent, prompt=PLANNING_PROMPT, artifacts=None):
+        super().__init__(name, client, prompt, artifacts=artifacts)
         self.implementation_agent = implementation_agent
+        self.tool_handlers["callImplementationAgent"] = self._call_implementation_agent
 
     tools = [
+      UPDATE_ARTIFACT_TOOL,
+      EDIT_ARTIFACT_TOOL,
       {
           "type": "function",
           "function": {
-              "name": "updateArtifact",
-              "description": "Update an artifact file which is HTML, CSS, or markdown with the given contents.",
+              "name": "callImplementationAgent",
+              "description": "Call the implementation agent to start building the page.",
               "parameters": {
                   "type": "object",
                   "properties": {
-                      "filename": {
-                          "type": "string",
-                          "description": "The name of the file to update.",
-                      },
-                      "contents": {
-                          "type": "string",
-                          "description": "The markdown, HTML, or CSS contents to write to the file.",
+                      "all_milestones": {
+                          "type": "boolean",
+                          "description": "Build all remaining milestones, instead of only the next one.",
                       },
                   },
-                  "required": ["filename", "contents"],
-                  "additionalProperties": False,
-              },
-          }
-      },
-      {
-          "type": "function",
-          "function": {
-              "name": "callImplementationAgent",
-              "description": "Call the implementation agent to start building the page.",
-              "parameters": {
-                  "type": "object",
-                  "properties": {},
                   "required": [],
                   "additionalProperties": False,
               },
@@ -82,77 +72,14 @@ class PlanningAgent(Agent):
       }
   ]
 
-    async def execute(self, message_history):
-        """
-        Executes the agent's main functionality.
-
-        Note: probably shouldn't couple this with chainlit, but this is just a prototype.
-        """
-        copied_message_history = message_history.copy()
+    # The implementation agent reads the plan saved in the same turn, and streams into the same message
+    terminal_tools = ("callImplementationAgent",)
 
-        # Check if the first message is a system prompt
-        if copied_message_history and copied_message_history[0]["role"] == "system":
-            # Replace the system prompt with the agent's prompt
-            copied_message_history[0] = {"role": "system", "content": self._build_system_prompt()}
+    async def _call_implementation_agent(self, arguments, turn):
+        # The implementation agent answers in this agent's message, so no follow-up reply is needed here
+        if arguments.get("all_milestones"):
+            await self.implementation_agent.execute_plan(turn["message_history"], turn["response_message"],
+                                                         turn["artifacts_context"])
         else:
-            # Insert the agent's prompt at the beginning
-            copied_message_history.insert(0, {"role": "system", "content": self._build_system_prompt()})
-
-        response_message = cl.Message(content="")
-        await response_message.send()
-
-        stream = await self.client.chat.completions.create(messages=copied_message_history, stream=True, tools=self.tools, tool_choice="auto", **self.gen_kwargs)
-
-        function_name = ""
-        arguments = ""
-        async for part in stream:
-            if part.choices[0].delta.tool_calls:
-                tool_call = part.choices[0].delta.tool_calls[0]
-                function_name_delta = tool_call.function.name or ""
-                arguments_delta = tool_call.function.arguments or ""
-
-                function_name += function_name_delta
-                arguments += arguments_delta
-
-            if token := part.choices[0].delta.content or "":
-                await response_message.stream_token(token)
-
-        if function_name:
-            print("DEBUG: function_name:")
-            print("type:", type(function_name))
-            print("value:", function_name)
-            print("DEBUG: arguments:")
-            print("type:", type(arguments))
-            print("value:", arguments)
-
-            if function_name == "updateArtifact":
-                import json
-
-                arguments_dict = json.loads(arguments)
-                filename = arguments_dict.get("filename")
-                contents = arguments_dict.get("contents")
-
-                if filename and contents:
-                    os.makedirs("artifacts", exist_ok=True)
-                    with open(os.path.join("artifacts", filename), "w") as file:
-                        file.write(contents)
-
-                    # Add a message to the message history
-                    message_history.append({
-                        "role": "system",
-                        "content": f"The artifact '{filename}' was updated."
-                    })
-
-                    stream = await self.client.chat.completions.create(messages=message_history, stream=True, **self.gen_kwargs)
-                    async for part in stream:
-                        if token := part.choices[0].delta.content or "":
-                            await response_message.stream_token(token)
-            elif function_name == "callImplementationAgent":
-                await self.implementation_agent.execute(message_history)
-        else:
-            print("No tool call")
-
-        await response_message.update()
-
-        return response_message.content
-
+            await self.implementation_agent.execute(turn["message_history"], turn["response_message"],
+                                                    turn["artifacts_context"])
@@ -0,0 +1,115 @@
+import asyncio
+
+
+class _JsonObjectScanner:
+    """
+    Tracks brace depth across streamed JSON fragments, to tell when an object is complete
+    without re-parsing the whole argument string on every delta.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text):
+        """Scans the new fragment and returns True once the top-level object has closed."""
+        for char in text:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+                self.started = True
+            elif char == "}":
+                self.depth -= 1
+        return self.started and self.depth == 0
+
+
+class ToolCallAccumulator:
+    """
+    Assembles streamed tool call deltas by their index, and starts each call as soon as it
+    is complete, so independent calls run concurrently with the rest of the stream.
+
+    `dispatch` is a coroutine function taking the assembled call
+    ({"id", "function": {"name", "arguments"}}) and returning its result.
+
+    `key` optionally maps a call to what it works on, such as the file it writes. Calls with
+    the same key aren't independent, so each one waits for the one before it, in index order.
+
+    Calls named in `terminal` aren't started early: finish() runs them last, one at a time,
+    once the stream has ended and every other call of the turn is done.
+    """
+
+    def __init__(self, dispatch, key=None, terminal=()):
+        self.dispatch = dispatch
+        self.key = key
+        self.terminal = set(terminal)
+        self.calls = {}
+        self._scanners = {}
+        self._tasks = {}
+        # key -> task of the last call started with that key
+        self._last_by_key = {}
+
+    def add(self, tool_call_deltas):
+        for delta in tool_call_deltas:
+            call = self.calls.get(delta.index)
+            if call is None:
+                call = self.calls[delta.index] = {"id": "", "function": {"name": "", "arguments": ""}}
+                self._scanners[delta.index] = _JsonObjectScanner()
+                # Calls are streamed one after another, so the ones before a new index are done
+                for index in self.calls:
+                    if index < delta.index:
+                        self._start(index)
+
+            if delta.id:
+                call["id"] = delta.id
+            if delta.function:
+                call["function"]["name"] += delta.function.name or ""
+                if arguments := delta.function.arguments or "":
+                    call["function"]["arguments"] += arguments
+                    if self._scanners[delta.index].feed(arguments):
+                        self._start(delta.index)
+
+    def _is_terminal(self, index):
+        return self.calls[index]["function"]["name"] in self.terminal
+
+    def _start(self, index):
+        if index in self._tasks or self._is_terminal(index):
+            return
+        # Calls before this one are complete, and starting them first keeps same-key calls in order
+        for earlier in sorted(self.calls):
+            if earlier < index and earlier not in self._tasks:
+                self._start(earlier)
+
+        call = self.calls[index]
+        key = self.key(call) if self.key else None
+        previous = self._last_by_key.get(key) if key is not None else None
+        task = asyncio.create_task(self._run_after(previous, call))
+        self._tasks[index] = task
+        if key is not None:
+            self._last_by_key[key] = task
+
+    async def _run_after(self, previous, call):
+        if previous is not None:
+            # Only the order matters here, the earlier call's result or error is reported on its own
+            await asyncio.wait([previous])
+        return await self.dispatch(call)
+
+    async def finish(self):
+        """Runs any calls still pending, terminal ones last, and returns (call, result) pairs in index order."""
+        for index in self.calls:
+            self._start(index)
+        indexes = sorted(self._tasks)
+        results = dict(zip(indexes, await asyncio.gather(*(self._tasks[index] for index in indexes))))
+        for index in sorted(self.calls):
+            if self._is_terminal(index):
+                results[index] = await self.dispatch(self.calls[index])
+        return [(self.calls[index], results[index]) for index in sorted(self.calls)]
@@ -1,8 +1,11 @@
 from dotenv import load_dotenv
 import chainlit as cl
+import os
+from agents.artifact_store import ArtifactStore
 from agents.implementation_agent import ImplementationAgent
 from agents.planning_agent import PlanningAgent
-import base64
+from images import forget_old_images, image_content_part
+import asyncio
 
 load_dotenv()
 
@@ -23,9 +26,8 @@ gen_kwargs = {
 
 SYSTEM_PROMPT = """ """
 
-# Create an instance of the Agent class
-implementation_agent = ImplementationAgent(name="Implementation Agent", client=client)
-planning_agent = PlanningAgent(name="Planning Agent", client=client, implementation_agent=implementation_agent)
+# Each chat session builds its page in its own folder under this one
+ARTIFACTS_DIR = "artifacts"
 
 @observe
 @cl.on_chat_start
@@ -33,6 +35,15 @@ def on_chat_start():
     message_history = [{"role": "system", "content": SYSTEM_PROMPT}]
     cl.user_session.set("message_history", message_history)
 
+    # Both agents share the session's artifact store, so a file written by one is seen by the other without rereading it
+    artifacts = ArtifactStore(os.path.join(ARTIFACTS_DIR, cl.user_session.get("id")))
+
+    # Create an instance of the Agent class
+    implementation_agent = ImplementationAgent(name="Implementation Agent", client=client, artifacts=artifacts)
+    planning_agent = PlanningAgent(name="Planning Agent", client=client, implementation_agent=implementation_agent,
+                                   artifacts=artifacts)
+    cl.user_session.set("planning_agent", planning_agent)
+
 @observe
 async def generate_response(client, message_history, gen_kwargs):
     response_message = cl.Message(content="")
@@ -56,9 +67,8 @@ async def on_message(message: cl.Message):
     images = [file for file in message.elements if "image" in file.mime] if message.elements else []
 
     if images:
-        # Read the first image and encode it to base64
-        with open(images[0].path, "rb") as f:
-            base64_image = base64.b64encode(f.read()).decode('utf-8')
+        # Downscale and encode the first image off the event loop
+        image_part = await asyncio.to_thread(image_content_part, images[0].path, images[0].mime)
         message_history.append({
             "role": "user",
             "content": [
@@ -66,17 +76,15 @@ async def on_message(message: cl.Message):
                     "type": "text",
                     "text": message.content
                 },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}"
-                    }
-                }
+                image_part
             ]
         })
+        # Only the newest image is re-sent on later turns
+        forget_old_images(message_history)
     else:
         message_history.append({"role": "user", "content": message.content})
 
+    planning_agent = cl.user_session.get("planning_agent")
     response_message = await planning_agent.execute(message_history)
 
     message_history.append({"role": "assistant", "content": response_message})
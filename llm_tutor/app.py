@@ -2,11 +2,11 @@ import os
 from dotenv import load_dotenv
 import chainlit as cl
 import openai
-import asyncio
 import json
 from datetime import datetime
 from prompts import ASSESSMENT_PROMPT, SYSTEM_PROMPT, CLASS_CONTEXT
-from student_record import read_student_record, write_student_record, format_student_record, parse_student_record
+from assessment_worker import AssessmentWorker
+from history import build_prompt
 from langsmith.wrappers import wrap_openai
 from langsmith import traceable
 
@@ -52,29 +52,31 @@ gen_kwargs = {
 ENABLE_SYSTEM_PROMPT = True
 ENABLE_CLASS_CONTEXT = True
 
-@traceable
-def get_latest_user_message(message_history):
-    # Iterate through the message history in reverse to find the last user message
-    for message in reversed(message_history):
-        if message['role'] == 'user':
-            return message['content']
-    return None
+# Maximum number of prompt tokens sent per request; older turns beyond it are dropped
+HISTORY_TOKEN_BUDGET = 6000
 
-@traceable
-async def assess_message(message_history):
-    file_path = "student_record.md"
-    markdown_content = read_student_record(file_path)
-    parsed_record = parse_student_record(markdown_content)
+STUDENT_RECORD_PATH = "student_record.md"
+
+# One worker per student record, so each student's assessments run one at a time
+assessment_workers = {}
 
-    latest_message = get_latest_user_message(message_history)
+def get_assessment_worker(record_path):
+    if record_path not in assessment_workers:
+        assessment_workers[record_path] = AssessmentWorker(assess_message, record_path)
+    return assessment_workers[record_path]
+
+@traceable
+async def assess_message(message_history, new_messages, parsed_record):
+    # Messages sent in quick succession are assessed together
+    latest_message = "\n\n".join(new_messages)
 
     # Remove the original prompt from the message history for assessment
     filtered_history = [msg for msg in message_history if msg['role'] != 'system']
 
-    # Convert message history, alerts, and knowledge to strings
-    history_str = json.dumps(filtered_history, indent=4)
-    alerts_str = json.dumps(parsed_record.get("Alerts", []), indent=4)
-    knowledge_str = json.dumps(parsed_record.get("Knowledge", {}), indent=4)
+    # Convert message history, alerts, and knowledge to compact strings, they're only read by the model
+    history_str = json.dumps(filtered_history, separators=(",", ":"), ensure_ascii=False)
+    alerts_str = json.dumps(parsed_record.get("Alerts", []), separators=(",", ":"), ensure_ascii=False)
+    knowledge_str = json.dumps(parsed_record.get("Knowledge", {}), separators=(",", ":"), ensure_ascii=False)
 
     current_date = datetime.now().strftime('%Y-%m-%d')
 
@@ -96,22 +98,7 @@ async def assess_message(message_history):
     print("Assessment Output: \n\n", assessment_output)
 
     # Parse the assessment output
-    new_alerts, knowledge_updates = parse_assessment_output(assessment_output)
-
-    # Update the student record with the new alerts and knowledge updates
-    parsed_record["Alerts"].extend(new_alerts)
-    for update in knowledge_updates:
-        topic = update["topic"]
-        note = update["note"]
-        parsed_record["Knowledge"][topic] = note
-
-    # Format the updated record and write it back to the file
-    updated_content = format_student_record(
-        parsed_record["Student Information"],
-        parsed_record["Alerts"],
-        parsed_record["Knowledge"]
-    )
-    write_student_record(file_path, updated_content)
+    return parse_assessment_output(assessment_output)
 
 @traceable
 def parse_assessment_output(output):
@@ -137,7 +124,7 @@ async def on_message(message: cl.Message):
 
     message_history.append({"role": "user", "content": message.content})
 
-    asyncio.create_task(assess_message(message_history))
+    get_assessment_worker(STUDENT_RECORD_PATH).submit(cl.user_session.get("id"), message_history, message.content)
 
     response_message = cl.Message(content="")
     await response_message.send()
@@ -148,7 +135,10 @@ async def on_message(message: cl.Message):
             if token := part.choices[0].text or "":
                 await response_message.stream_token(token)
     else:
-        stream = await client.chat.completions.create(messages=message_history, stream=True, **gen_kwargs)
+        messages, prompt_metrics = build_prompt(message_history, HISTORY_TOKEN_BUDGET)
+        print("Prompt metrics:", prompt_metrics)
+        cl.user_session.set("prompt_metrics", prompt_metrics)
+        stream = await client.chat.completions.create(messages=messages, stream=True, **gen_kwargs)
         async for part in stream:
             if token := part.choices[0].delta.content or "":
                 await response_message.stream_token(token)
@@ -0,0 +1,75 @@
+"""
+Background assessment of a student's messages, one worker per student record.
+
+Each new message is submitted to the student's worker instead of starting its own task.
+The worker runs one assessment at a time, and messages from the same session that arrive
+while one is running (or within a short delay of each other) are assessed together in the
+next one, so a burst of messages costs one model call and one write of the record.
+
+The parsed record is kept in memory after the first read, and the markdown file is only
+written, off the event loop, after an assessment changes it.
+"""
+
+import asyncio
+
+from student_record import format_student_record, parse_student_record, read_student_record, write_student_record
+
+# Messages submitted within this many seconds of each other are assessed together
+COALESCE_DELAY = 1.0
+
+
+class AssessmentWorker:
+    def __init__(self, assess, record_path, coalesce_delay=COALESCE_DELAY):
+        """
+        `assess` is a coroutine function taking (message_history, new_messages, record) and
+        returning (new_alerts, knowledge_updates).
+        """
+        self.assess = assess
+        self.record_path = record_path
+        self.coalesce_delay = coalesce_delay
+        self.record = None
+        # session id -> (latest message history of the session, messages not assessed yet)
+        self._pending = {}
+        self._task = None
+
+    def submit(self, session_id, message_history, new_message):
+        """
+        Schedules an assessment of the new message, merging it with any from the same session
+        that hasn't started yet. Each session's messages are assessed against its own history.
+        """
+        pending_messages = self._pending[session_id][1] if session_id in self._pending else []
+        self._pending[session_id] = (list(message_history), pending_messages + [new_message])
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # Only this task touches the record, so updates never race each other
+        while self._pending:
+            await asyncio.sleep(self.coalesce_delay)
+            pending, self._pending = self._pending, {}
+            for message_history, new_messages in pending.values():
+                try:
+                    await self._assess(message_history, new_messages)
+                except Exception as e:
+                    print("Assessment failed:", e)
+
+    async def _assess(self, message_history, new_messages):
+        if self.record is None:
+            markdown_content = await asyncio.to_thread(read_student_record, self.record_path)
+            self.record = parse_student_record(markdown_content)
+
+        new_alerts, knowledge_updates = await self.assess(message_history, new_messages, self.record)
+        if not new_alerts and not knowledge_updates:
+            return
+
+        # Update the student record with the new alerts and knowledge updates
+        self.record["Alerts"].extend(new_alerts)
+        for update in knowledge_updates:
+            self.record["Knowledge"][update["topic"]] = update["note"]
+
+        updated_content = format_student_record(
+            self.record["Student Information"],
+            self.record["Alerts"],
+            self.record["Knowledge"]
+        )
+        await asyncio.to_thread(write_student_record, self.record_path, updated_content)
@@ -0,0 +1,112 @@
+"""
+Token-budgeted window over the chat message history.
+
+The full history stays in the user session, but only a bounded window of it is sent
+to the model: the leading system messages are always kept, and the most recent turns
+are added from newest to oldest until the token budget is spent. Older turns are
+dropped from the request, so prompt size stops growing with the length of a session.
+
+Token counts are cached per message content, so each turn only counts the messages
+that are new since the previous turn.
+
+The apps import this through the `history.py` next to their app.py.
+"""
+
+import json
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_TOKEN_BUDGET = 6000
+
+# Tokens the chat format adds around each message for the role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Rough cost of an image part (a high-detail image is a few 512px tiles)
+IMAGE_TOKENS = 765
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    # cl100k_base tokenizes a little less efficiently than newer encodings, so counts err on the high side
+    return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=8192)
+def count_text_tokens(text):
+    encoding = _encoding()
+    if encoding is None:
+        # Without tiktoken, assume roughly four characters per token
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message):
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    content = message.get("content")
+    if isinstance(content, str):
+        tokens += count_text_tokens(content)
+    elif isinstance(content, list):
+        for part in content:
+            if part.get("type") == "text":
+                tokens += count_text_tokens(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                tokens += IMAGE_TOKENS
+    for tool_call in message.get("tool_calls") or []:
+        tokens += count_text_tokens(json.dumps(tool_call.get("function", {})))
+    return tokens
+
+
+def build_prompt(message_history, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Selects the messages to send for this turn.
+
+    Returns (messages, metrics), where metrics describes the size of the prompt.
+    The latest message is always included, even if it alone exceeds the budget.
+    """
+    pinned_count = 0
+    while pinned_count < len(message_history) and message_history[pinned_count].get("role") == "system":
+        pinned_count += 1
+    pinned = message_history[:pinned_count]
+    turns = message_history[pinned_count:]
+
+    pinned_tokens = sum(count_message_tokens(message) for message in pinned)
+    remaining = token_budget - pinned_tokens
+
+    kept_tokens = 0
+    start = len(turns)
+    while start > 0:
+        message_tokens = count_message_tokens(turns[start - 1])
+        if kept_tokens + message_tokens > remaining and start < len(turns):
+            break
+        kept_tokens += message_tokens
+        start -= 1
+
+    # A tool result can't be sent without the assistant message that requested it
+    first_kept = start
+    while first_kept < len(turns) and turns[first_kept].get("role") == "tool":
+        first_kept += 1
+    if first_kept < len(turns):
+        # Something follows the orphaned results, so they can be dropped
+        kept_tokens -= sum(count_message_tokens(message) for message in turns[start:first_kept])
+        start = first_kept
+    else:
+        # The window is only tool results, so it grows back to include the call that requested them
+        while start > 0 and turns[start].get("role") == "tool":
+            start -= 1
+            kept_tokens += count_message_tokens(turns[start])
+
+    messages = pinned + turns[start:]
+    metrics = {
+        "prompt_tokens": pinned_tokens + kept_tokens,
+        "token_budget": token_budget,
+        "history_messages": len(message_history),
+        "sent_messages": len(messages),
+        "dropped_messages": start,
+    }
+    return messages, metrics
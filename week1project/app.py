@@ -5,6 +5,7 @@ import base64
 from dotenv import load_dotenv
 from langsmith.wrappers import wrap_openai
 from langsmith import traceable
+from history import build_prompt
 from prompts import SYSTEM_PROMPT
 
 # Load environment variables
@@ -36,6 +37,9 @@ gen_kwargs = {
 # Configuration setting to enable or disable the system prompt
 ENABLE_SYSTEM_PROMPT = True
 
+# Maximum number of prompt tokens sent per request; older turns beyond it are dropped
+HISTORY_TOKEN_BUDGET = 6000
+
 @traceable
 @cl.on_message
 async def on_message(message: cl.Message):
@@ -51,8 +55,11 @@ async def on_message(message: cl.Message):
     response_message = cl.Message(content="")
     await response_message.send()
 
-    # Pass in the full message history for each request
-    stream = await client.chat.completions.create(messages=message_history,
+    # Pass in the system prompts and as many recent turns as fit in the token budget
+    messages, prompt_metrics = build_prompt(message_history, HISTORY_TOKEN_BUDGET)
+    print("Prompt metrics:", prompt_metrics)
+    cl.user_session.set("prompt_metrics", prompt_metrics)
+    stream = await client.chat.completions.create(messages=messages,
                                                   stream=True, **gen_kwargs)
     async for part in stream:
         if token := part.choices[0].delta.content or "":